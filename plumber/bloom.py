@@ -0,0 +1,58 @@
+import hashlib
+
+from plumber.common import UTF8
+
+BITS_PER_ENTRY = 10
+HASH_COUNT = 7
+MAX_CHANGED_PATHS = 512
+MIN_FILTER_SIZE = 8
+
+
+def path_entries(path):
+  entries = [path]
+  while '/' in path:
+    path = path[:path.rindex('/')]
+    entries.append(path)
+  return entries
+
+
+class BloomFilter:
+
+  def __init__(self, data=None):
+    self.data = bytearray(data) if data is not None else bytearray()
+
+  @staticmethod
+  def from_paths(paths):
+    if len(paths) > MAX_CHANGED_PATHS:
+      return BloomFilter()
+    entries = set()
+    for path in paths:
+      entries.update(path_entries(path))
+    bloom = BloomFilter(bytearray(
+        max(MIN_FILTER_SIZE, (len(entries) * BITS_PER_ENTRY + 7) // 8)))
+    for entry in entries:
+      bloom.add(entry)
+    return bloom
+
+  def is_saturated(self):
+    return len(self.data) == 0
+
+  def _positions(self, entry):
+    digest = hashlib.sha1(entry.encode(UTF8)).digest()
+    first = int.from_bytes(digest[:4], 'little')
+    second = int.from_bytes(digest[4:8], 'little')
+    size = len(self.data) * 8
+    return [(first + i * second) % size for i in range(HASH_COUNT)]
+
+  def add(self, entry):
+    for position in self._positions(entry):
+      self.data[position // 8] |= 1 << position % 8
+
+  def might_contain(self, path):
+    if self.is_saturated():
+      return True
+    return all(self.data[position // 8] >> position % 8 & 1 for position in
+               self._positions(path))
+
+  def to_bytes(self):
+    return bytes(self.data)
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from plumber.common import LOG, UTF8
+
+CACHE_SCHEMA = [
+  'CREATE TABLE IF NOT EXISTS changes (key TEXT PRIMARY KEY, '
+  'data BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)',
+  'CREATE TABLE IF NOT EXISTS matches (key TEXT PRIMARY KEY, '
+  'result INTEGER NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)',
+  'CREATE TABLE IF NOT EXISTS blooms (key TEXT PRIMARY KEY, '
+  'data BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)'
+]
+STAT_SCHEMA = 'CREATE TABLE IF NOT EXISTS stats (path TEXT PRIMARY KEY, ' \
+              'mtime INTEGER NOT NULL, size INTEGER NOT NULL, ' \
+              'inode INTEGER NOT NULL, oid TEXT NOT NULL)'
+CACHE_TABLES = ('changes', 'matches', 'blooms')
+MATCH_ENTRY_SIZE = 128
+MAX_PENDING_ENTRIES = 1000
+
+
+def hash_key(*parts):
+  return hashlib.sha1(
+      json.dumps(parts, sort_keys=True, default=str).encode(UTF8)).hexdigest()
+
+
+class DiffCache:
+
+  def __init__(self, path, max_size):
+    self.path = path
+    self.max_size = max_size
+    self.connection = None
+    self.size = None
+    self.writes = {}
+    self.accesses = {}
+
+  def _connect(self):
+    if self.connection is None:
+      directory = os.path.dirname(self.path)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      self.connection = sqlite3.connect(self.path, timeout=30,
+                                        isolation_level=None)
+      self.connection.execute('PRAGMA journal_mode=WAL')
+      for statement in CACHE_SCHEMA:
+        self.connection.execute(statement)
+      self.size = sum(self.connection.execute(
+          'SELECT COALESCE(SUM(size), 0) FROM {}'.format(table)).fetchone()[0]
+                      for table in CACHE_TABLES)
+    return self.connection
+
+  def get_changes(self, base, head, pathspecs):
+    row = self._get('changes', 'data', hash_key(base, head, pathspecs))
+    if row is None:
+      return None
+    return json.loads(zlib.decompress(row).decode(UTF8))
+
+  def save_changes(self, base, head, pathspecs, changes):
+    data = zlib.compress(json.dumps(changes).encode(UTF8))
+    self._save('changes', 'data', hash_key(base, head, pathspecs), data,
+               len(data))
+
+  def get_match(self, base, head, pattern):
+    row = self._get('matches', 'result', hash_key(base, head, pattern))
+    if row is None:
+      return None
+    return bool(row)
+
+  def save_match(self, base, head, pattern, result):
+    self._save('matches', 'result', hash_key(base, head, pattern),
+               int(result), MATCH_ENTRY_SIZE)
+
+  def get_bloom(self, commit):
+    return self._get('blooms', 'data', commit)
+
+  def save_bloom(self, commit, data):
+    self._save('blooms', 'data', commit, data, len(data) + MATCH_ENTRY_SIZE)
+
+  def get_size(self):
+    self.flush()
+    self._connect()
+    return self.size
+
+  def flush(self):
+    if len(self.writes) == 0 and len(self.accesses) == 0:
+      return
+    writes, accesses = self.writes, self.accesses
+    self.writes, self.accesses = {}, {}
+    try:
+      connection = self._connect()
+      connection.execute('BEGIN IMMEDIATE')
+      try:
+        delta = 0
+        for (table, key), accessed in accesses.items():
+          connection.execute(
+              'UPDATE {} SET accessed = ? WHERE key = ?'.format(table),
+              (accessed, key))
+        for (table, key), (column, value, size, accessed) in writes.items():
+          row = connection.execute(
+              'SELECT size FROM {} WHERE key = ?'.format(table),
+              (key,)).fetchone()
+          connection.execute(
+              'INSERT OR REPLACE INTO {} (key, {}, size, accessed) '
+              'VALUES (?, ?, ?, ?)'.format(table, column),
+              (key, value, size, accessed))
+          delta += size - (row[0] if row is not None else 0)
+        connection.execute('COMMIT')
+      except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+      self.size += delta
+    except (sqlite3.Error, OSError) as e:
+      LOG.warning('Could not write to diff cache {}: {}'.format(self.path, e))
+
+  def evict(self):
+    connection = self._connect()
+    if self.size <= self.max_size:
+      return
+    LOG.debug('Diff cache size {} exceeds {}, evicting'.format(self.size,
+                                                               self.max_size))
+    entries = connection.execute(' UNION ALL '.join(
+        'SELECT key, size, accessed, \'{0}\' FROM {0}'.format(table) for table
+        in CACHE_TABLES) + ' ORDER BY accessed').fetchall()
+    size = self.size
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+      for key, entry_size, _, table in entries:
+        if size <= self.max_size:
+          break
+        connection.execute('DELETE FROM {} WHERE key = ?'.format(table),
+                           (key,))
+        size -= entry_size
+      connection.execute('COMMIT')
+    except BaseException:
+      connection.execute('ROLLBACK')
+      raise
+    self.size = size
+
+  def close(self):
+    self.flush()
+    if self.connection is not None:
+      try:
+        self.evict()
+      except (sqlite3.Error, OSError) as e:
+        LOG.warning(
+            'Could not evict from diff cache {}: {}'.format(self.path, e))
+      self.connection.close()
+      self.connection = None
+      self.size = None
+
+  def _get(self, table, column, key):
+    if (table, key) in self.writes:
+      return self.writes[(table, key)][1]
+    try:
+      connection = self._connect()
+      row = connection.execute(
+          'SELECT {} FROM {} WHERE key = ?'.format(column, table),
+          (key,)).fetchone()
+      if row is None:
+        return None
+      self.accesses[(table, key)] = time.time()
+      self._flush_if_full()
+      return row[0]
+    except (sqlite3.Error, OSError) as e:
+      LOG.warning('Could not read from diff cache {}: {}'.format(self.path, e))
+      return None
+
+  def _save(self, table, column, key, value, size):
+    self.accesses.pop((table, key), None)
+    self.writes[(table, key)] = (column, value, size, time.time())
+    self._flush_if_full()
+
+  def _flush_if_full(self):
+    if len(self.writes) + len(self.accesses) >= MAX_PENDING_ENTRIES:
+      self.flush()
+
+
+class StatCache:
+
+  def __init__(self, path):
+    self.path = path
+    self.connection = None
+
+  def _connect(self):
+    if self.connection is None:
+      directory = os.path.dirname(self.path)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      self.connection = sqlite3.connect(self.path, timeout=30)
+      self.connection.execute('PRAGMA journal_mode=WAL')
+      self.connection.execute(STAT_SCHEMA)
+    return self.connection
+
+  def get_stats(self):
+    try:
+      return {row[0]: tuple(row[1:]) for row in self._connect().execute(
+          'SELECT path, mtime, size, inode, oid FROM stats')}
+    except (sqlite3.Error, OSError) as e:
+      LOG.warning('Could not read from stat cache {}: {}'.format(self.path, e))
+      return {}
+
+  def save_stats(self, entries, removed=()):
+    try:
+      connection = self._connect()
+      with connection:
+        connection.executemany(
+            'INSERT OR REPLACE INTO stats (path, mtime, size, inode, oid) '
+            'VALUES (?, ?, ?, ?, ?)', entries)
+        connection.executemany('DELETE FROM stats WHERE path = ?',
+                               [(path,) for path in removed])
+    except (sqlite3.Error, OSError) as e:
+      LOG.warning('Could not write to stat cache {}: {}'.format(self.path, e))
+
+  def close(self):
+    if self.connection is not None:
+      self.connection.close()
+      self.connection = None
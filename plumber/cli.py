@@ -39,7 +39,8 @@ def print_banner():
                           'The CD\CI tool you deserve :)', 'Initiating...')))
 
 
-def get_planner(cfg, verbose, log_file):
+def get_planner(cfg, verbose, log_file, pipe_ids=None, tags=None,
+    excluded_ids=None):
   set_logging(verbose, log_file)
   print_banner()
   if cfg is None:
@@ -50,7 +51,19 @@ def get_planner(cfg, verbose, log_file):
   if config is None or len(config) == 0:
     plumber.common.LOG.error('Configuration not found')
     sys.exit(1)
-  return PlumberPlanner(config)
+  return PlumberPlanner(config, pipe_ids, tags, excluded_ids)
+
+
+def selection_options(command):
+  command = click.option('--exclude', '-x', multiple=True,
+                         help='Skip the pipe with this id, can be repeated')(
+      command)
+  command = click.option('--tag', '-t', multiple=True,
+                         help='Only handle the pipes with this tag, can be '
+                              'repeated')(command)
+  return click.option('--pipe', '-p', multiple=True,
+                      help='Only handle the pipe with this id, can be '
+                           'repeated')(command)
 
 
 @click.group(name='plumber')
@@ -67,10 +80,11 @@ def cli():
 @click.option('--verbose', '-v', help='Set the verbosity level', count=True)
 @click.option('--log-file', '-l', help='Create an output log file',
               is_flag=True, default=False)
-def get_report(cfg, verbose, log_file):
+@selection_options
+def get_report(cfg, verbose, log_file, pipe, tag, exclude):
   """Detect changes and print out a report"""
   try:
-    planner = get_planner(cfg, verbose, log_file)
+    planner = get_planner(cfg, verbose, log_file, pipe, tag, exclude)
     report = planner.get_analysis_report()
     if plumber.common.LOG.level < logging.WARN:
       click.echo(wrap_in_dividers('Final Report'))
@@ -80,6 +94,25 @@ def get_report(cfg, verbose, log_file):
     sys.exit(1)
 
 
+@click.command('prepare')
+@click.option('--cfg', '-c', help='Path to plumber config file')
+@click.option('--verbose', '-v', help='Set the verbosity level', count=True)
+@click.option('--log-file', '-l', help='Create an output log file',
+              is_flag=True, default=False)
+@selection_options
+def prepare(cfg, verbose, log_file, pipe, tag, exclude):
+  """Warm up the repository and caches for detection"""
+  try:
+    planner = get_planner(cfg, verbose, log_file, pipe, tag, exclude)
+    report = planner.prepare()
+    if plumber.common.LOG.level < logging.WARN:
+      click.echo(wrap_in_dividers('Final Report'))
+    click.echo(plumber.common.create_initial_report(report))
+  except Exception as e:
+    plumber.common.LOG.error(''.join(f'\n{l}' for l in e.args))
+    sys.exit(1)
+
+
 @click.command('init')
 @click.option('--cfg', '-c', help='Path to plumber config file')
 @click.option('--force', '-f', is_flag=True,
@@ -87,10 +120,11 @@ def get_report(cfg, verbose, log_file):
 @click.option('--verbose', '-v', help='Set the verbosity level', count=True)
 @click.option('--log-file', '-l', help='Create an output log file',
               is_flag=True, default=False)
-def init(cfg, force, verbose, log_file):
+@selection_options
+def init(cfg, force, verbose, log_file, pipe, tag, exclude):
   """Initiate a new checkpoint"""
   try:
-    planner = get_planner(cfg, verbose, log_file)
+    planner = get_planner(cfg, verbose, log_file, pipe, tag, exclude)
     planner.init_checkpoint(force)
   except Exception as e:
     plumber.common.LOG.error(''.join(f'\n{l}' for l in e.args))
@@ -104,10 +138,11 @@ def init(cfg, force, verbose, log_file):
 @click.option('--verbose', '-v', help='Set the verbosity level', count=True)
 @click.option('--log-file', '-l', help='Create an output log file',
               is_flag=True, default=False)
-def execute(cfg, no_checkpoint, verbose, log_file):
+@selection_options
+def execute(cfg, no_checkpoint, verbose, log_file, pipe, tag, exclude):
   """Detect changes and run CD/CI steps"""
   try:
-    planner = get_planner(cfg, verbose, log_file)
+    planner = get_planner(cfg, verbose, log_file, pipe, tag, exclude)
     results = None
     try:
       results = planner.execute(not no_checkpoint)
@@ -124,6 +159,7 @@ def execute(cfg, no_checkpoint, verbose, log_file):
 cli.add_command(get_report)
 cli.add_command(execute)
 cli.add_command(init)
+cli.add_command(prepare)
 
 if __name__ == '__main__':
   cli()
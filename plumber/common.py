@@ -1,3 +1,4 @@
+import ast
 import os
 import logging
 import yaml
@@ -26,6 +27,11 @@ STDOUT = 'stdout'
 STDERR = 'stderr'
 TYPE = 'type'
 LOCALDIFF = 'localdiff'
+WORKTREE = 'worktree'
+FILEHASH = 'filehash'
+FILES = 'files'
+SCANNED = 'scanned'
+WORKERS = 'workers'
 CONDITIONS = 'conditions'
 CONDITION = 'condition'
 ACTIONS = 'actions'
@@ -42,6 +48,7 @@ ALWAYS = 'always'
 SUCCESS = 'success'
 FAILURE = 'failure'
 PIPES = 'pipes'
+TAGS = 'tags'
 PIPE = 'pipe'
 SCOPE = 'scope'
 SINGLE = 'single'
@@ -52,10 +59,34 @@ STATUS = 'status'
 UNKNOWN = 'unknown'
 EXECUTED = 'executed'
 CONTENT = 'content'
+MAX_SIZE = 'maxsize'
+PICKAXE = 'pickaxe'
+KEYS = 'keys'
+CACHE = 'cache'
+SHALLOW = 'shallow'
+SUBMODULES = 'submodules'
+DEPTH = 'depth'
+MAX_DEPTH = 'maxdepth'
+CHECKPOINT = 'checkpoint'
+TREE = 'tree'
+PREFIXES = 'prefixes'
 PLACEHOLDER = 'placeholder'
 REGION = 'region'
 AWS_S3 = 'aws-s3'
 DEFAULT_CHECKPOINT_FILENAME = '.plumber.checkpoint.yml'
+DEFAULT_CONTENT_MAX_SIZE = 10 * 1024 * 1024
+PICKAXE_BATCH_SIZE = 500
+CONTENT_BATCH_SIZE = 500
+COMMIT_BATCH_SIZE = 500
+DEFAULT_CACHE_MAX_SIZE = 64 * 1024 * 1024
+DEFAULT_OBJECT_CACHE_SIZE = 32 * 1024 * 1024
+DEFAULT_DEEPEN_DEPTH = 64
+DEFAULT_DEEPEN_MAX_DEPTH = 4096
+COST_CACHED = 0
+COST_PATH = 1
+COST_CONTENT = 2
+COST_TARGET_BRANCH = 2
+COST_SCAN = 3
 
 GITMOJI = {
   DETECTED: ':heavy_plus_sign:',
@@ -138,10 +169,96 @@ def get_or_default(config, name, default, value_type=None,
     return default
 
 
+class CompiledExpression:
+
+  def __init__(self, expression):
+    self.expression = expression
+    try:
+      self.tree = ast.parse(expression.strip(), mode='eval').body
+    except SyntaxError as e:
+      raise ConfigError('Invalid expression {}'.format(expression), e)
+    self.names = set()
+    self._validate(self.tree)
+
+  def _validate(self, node):
+    if isinstance(node, ast.BoolOp):
+      for value in node.values:
+        self._validate(value)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+      self._validate(node.operand)
+    elif isinstance(node, ast.Name):
+      self.names.add(node.id)
+    elif not isinstance(node, ast.Constant):
+      raise ConfigError(
+          'Unsupported syntax in expression {}, only and, or, not, names and '
+          'literals are allowed'.format(self.expression))
+
+  def evaluate(self, values):
+    return self._evaluate(self.tree, self._lookup(values), None)
+
+  def evaluate_lazy(self, resolvers, costs=None):
+    for name in sorted(self.names):
+      self._lookup(resolvers)(name)
+    values = {}
+
+    def resolve(name):
+      if name not in values:
+        values[name] = resolvers[name]()
+      return values[name]
+
+    def cost(name):
+      if name in values or costs is None:
+        return COST_CACHED
+      return costs.get(name, COST_CACHED)
+
+    return self._evaluate(self.tree, resolve, cost)
+
+  def _lookup(self, values):
+    def lookup(name):
+      if name not in values:
+        raise NameError('name \'{}\' is not defined'.format(name))
+      return values[name]
+
+    return lookup
+
+  def _evaluate(self, node, lookup, cost):
+    if isinstance(node, ast.BoolOp):
+      operands = node.values
+      if cost is not None:
+        operands = sorted(operands, key=lambda value: self._cost(value, cost))
+      result = None
+      for value in operands:
+        result = self._evaluate(value, lookup, cost)
+        if isinstance(node.op, ast.And) != bool(result):
+          return result
+      return result
+    if isinstance(node, ast.UnaryOp):
+      return not self._evaluate(node.operand, lookup, cost)
+    if isinstance(node, ast.Name):
+      return lookup(node.id)
+    return node.value
+
+  def _cost(self, node, cost):
+    if isinstance(node, ast.BoolOp):
+      return sum(self._cost(value, cost) for value in node.values)
+    if isinstance(node, ast.UnaryOp):
+      return self._cost(node.operand, cost)
+    if isinstance(node, ast.Name):
+      return cost(node.id)
+    return COST_CACHED
+
+
+COMPILED_EXPRESSIONS = {}
+
+
+def compile_expression(expression):
+  if expression not in COMPILED_EXPRESSIONS:
+    COMPILED_EXPRESSIONS[expression] = CompiledExpression(expression)
+  return COMPILED_EXPRESSIONS[expression]
+
+
 def evaluate_expression(expression, exp_dict):
-  for key in exp_dict:
-    exec('{} = {}'.format(key, exp_dict[key]))
-  return eval(expression)
+  return compile_expression(expression).evaluate(exp_dict)
 
 
 def create_execution_log(result):
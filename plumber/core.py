@@ -1,14 +1,17 @@
 import yaml
 
-from plumber.common import LOG, evaluate_expression, ConfigError, \
+from plumber.common import LOG, compile_expression, ConfigError, \
   ExecutionFailure, EXPRESSION, ID, ACTIONS, TYPE, \
   LOCALDIFF, GLOBAL, CHECKPOINTING, UNIT, CONDITIONS, CONDITION, ALWAYS, \
   FAILURE, SUCCESS, PREHOOK, POSTHOOK, PIPES, get_or_default, \
   DETECTED, SINGLE, STATUS, UNKNOWN, EXECUTED, \
   NOT_DETECTED, PIPE, FAILED, PLUMBER_LOGS, create_execution_report, \
-  wrap_in_dividers
+  wrap_in_dividers, CACHE, SHALLOW, WORKTREE, FILEHASH, TAGS, STEPS
+from plumber.cache import hash_key
+from plumber.diffs import DiffService
 from plumber.io import create_checkpoint_store
-from plumber.operators import Executor, LocalDiffConditional
+from plumber.operators import Executor, LocalDiffConditional, \
+  WorktreeConditional, FileHashConditional, SharedConditional
 
 
 class Hooked:
@@ -86,11 +89,18 @@ class PlumberPipe(Hooked):
   def __init__(self):
     super(PlumberPipe, self).__init__()
     self.config = None
-    self.conditions = None
-    self.actions = None
     self.checkpoint = None
-
-  def configure(self, config, checkpoint):
+    self.expression = None
+    self.tags = None
+    self.diff_service = None
+    self.conditionals = None
+    self.condition_configs = None
+    self.actions_config = None
+    self._conditions = None
+    self._actions = None
+
+  def configure(self, config, checkpoint, diff_service=None,
+      conditionals=None):
     super(PlumberPipe, self).configure(config=config)
     id = get_or_default(config, ID, None, str)
     if id is None:
@@ -99,9 +109,15 @@ class PlumberPipe(Hooked):
               yaml.dump(config)))
     self.config = config
     self.checkpoint = checkpoint
+    self.diff_service = diff_service
+    self.conditionals = conditionals
+    self.tags = get_or_default(config, TAGS, [], list)
+    expression = get_or_default(config, EXPRESSION, None, str)
+    if expression is not None:
+      self.expression = compile_expression(expression)
     conditions = get_or_default(config, CONDITIONS, None, list)
     if conditions is not None:
-      self.conditions = []
+      self.condition_configs = []
       declared_conditions = set()
       for condition_config in conditions:
         id = get_or_default(condition_config, ID, None, str)
@@ -115,28 +131,48 @@ class PlumberPipe(Hooked):
                                                                        yaml.dump(
                                                                            condition_config)))
         declared_conditions.add(id)
-        self.conditions.append({ID: id,
-                                CONDITION: _create_conditional(condition_config,
-                                                               get_or_default(
-                                                                   checkpoint,
-                                                                   id, {},
-                                                                   dict))})
-    actions = get_or_default(config, ACTIONS, None, dict)
-    if actions is not None:
-      self.actions = Executor()
-      self.actions.configure(actions)
+        _validate_conditional(condition_config)
+        self.condition_configs.append((id, condition_config))
+    self.actions_config = get_or_default(config, ACTIONS, None, dict)
+    if self.actions_config is not None and get_or_default(
+        self.actions_config, STEPS, None, list) is None:
+      raise ConfigError('No steps specified to execute:\n{}'.format(
+          yaml.dump(self.actions_config)))
+
+  @property
+  def conditions(self):
+    if self._conditions is None and self.condition_configs is not None:
+      LOG.debug('Creating the conditions of pipe {}'.format(self.config[ID]))
+      self._conditions = [{ID: id,
+                           CONDITION: _create_conditional(condition_config,
+                                                          get_or_default(
+                                                              self.checkpoint,
+                                                              id, {}, dict),
+                                                          self.diff_service,
+                                                          self.conditionals)}
+                          for id, condition_config in self.condition_configs]
+    return self._conditions
+
+  @property
+  def actions(self):
+    if self._actions is None and self.actions_config is not None:
+      self._actions = Executor()
+      self._actions.configure(self.actions_config)
+    return self._actions
 
   def evaluate(self):
     if self.conditions is None:
       return True
-    expression = get_or_default(self.config, EXPRESSION, None, str)
-    if expression is not None:
-      exp_values = {}
+    if self.expression is not None:
+      resolvers = {}
+      costs = {}
       for condition in self.conditions:
-        exp_values[condition[ID]] = condition[CONDITION].evaluate()
-      return evaluate_expression(expression, exp_values)
+        resolvers[condition[ID]] = condition[CONDITION].evaluate
+        costs[condition[ID]] = condition[CONDITION].get_cost()
+      return self.expression.evaluate_lazy(resolvers, costs)
     else:
-      for condition in self.conditions:
+      for condition in sorted(self.conditions, key=lambda condition: condition[
+        CONDITION].get_cost()):
         if condition[CONDITION].evaluate():
           return True
       return False
@@ -144,6 +180,14 @@ class PlumberPipe(Hooked):
   def execute(self):
     self.actions.execute()
 
+  def prepare(self):
+    if self.conditions is None:
+      return True
+    prepared = True
+    for condition in self.conditions:
+      prepared = condition[CONDITION].prepare() and prepared
+    return prepared
+
   def get_new_checkpoint(self):
     if self.conditions is None:
       return None
@@ -171,17 +215,22 @@ class PlumberPipe(Hooked):
 
 class PlumberPlanner(Hooked):
 
-  def __init__(self, config):
+  def __init__(self, config, pipe_ids=None, tags=None, excluded_ids=None):
     super(PlumberPlanner, self).__init__()
     self.config = config
     self.checkpoint_store = None
     self.pipes = None
+    self.selective = bool(pipe_ids or tags or excluded_ids)
     self.results = None
     self.checkpoint_unit = SINGLE
     self.posthooks_execute = False
+    self.diff_service = None
     global_config = get_or_default(config, GLOBAL, None, dict)
     if global_config is not None:
       super(PlumberPlanner, self).configure(global_config)
+      self.diff_service = DiffService(
+          cache_config=get_or_default(global_config, CACHE, None, dict),
+          shallow_config=get_or_default(global_config, SHALLOW, None, dict))
       checkpointing_config = get_or_default(global_config, CHECKPOINTING, None,
                                             dict)
       if checkpointing_config is not None:
@@ -194,9 +243,12 @@ class PlumberPlanner(Hooked):
         self.checkpoint_store = create_checkpoint_store()
     else:
       self.checkpoint_store = create_checkpoint_store()
+    if self.diff_service is None:
+      self.diff_service = DiffService()
     self.current_checkpoint = self.checkpoint_store.get_data()
     if PIPES in config:
       self.pipes = []
+      conditionals = {}
       declared_pipe_ids = set()
       for pipe_config in config[PIPES]:
         if ID not in pipe_config:
@@ -205,11 +257,18 @@ class PlumberPlanner(Hooked):
           raise ConfigError(
               'Multiple pipes configured with id: {}'.format(pipe_config[ID]))
         declared_pipe_ids.add(pipe_config[ID])
+        if not _is_pipe_selected(pipe_config, pipe_ids, tags, excluded_ids):
+          LOG.debug('Pipe {} not selected, skipping'.format(pipe_config[ID]))
+          continue
         pipe = PlumberPipe()
         pipe.configure(pipe_config,
                        get_or_default(self.current_checkpoint, pipe_config[ID],
-                                      {}))
+                                      {}), self.diff_service, conditionals)
         self.pipes.append(pipe)
+      missing_pipe_ids = set(pipe_ids or []).difference(declared_pipe_ids)
+      if len(missing_pipe_ids) > 0:
+        raise ConfigError('No pipes configured with ids: {}'.format(
+            ', '.join(sorted(missing_pipe_ids))))
 
   def run_prehooks(self):
     if self.prehooks is not None:
@@ -236,18 +295,45 @@ class PlumberPlanner(Hooked):
         {ID: pipe.config[ID], DETECTED: pipe.wrap_in_hooks(pipe.evaluate)()}
         for pipe in self.pipes]
 
-    return self.wrap_in_hooks(get_report)()
+    return self.wrap_in_hooks(get_report, lambda _: self.close())()
+
+  def close(self):
+    self.diff_service.close()
+
+  def prepare(self):
+    if self.pipes is None:
+      raise ExecutionFailure('No pipes configured')
+    LOG.log(PLUMBER_LOGS, wrap_in_dividers('Preparing the repository'))
+    try:
+      for pipe in self.pipes:
+        if not pipe.prepare():
+          LOG.warning(
+              'Checkpoint of pipe {} is not available locally'.format(
+                  pipe.config[ID]))
+      self.diff_service.write_commit_graph()
+      return [{ID: pipe.config[ID], DETECTED: pipe.evaluate()} for pipe in
+              self.pipes]
+    finally:
+      self.close()
 
   def init_checkpoint(self, force=False):
     new_checkpoint = {}
-    if len(self.current_checkpoint) != 0 and not force:
+    existing = self.current_checkpoint
+    if self.selective and self.pipes is not None:
+      new_checkpoint = dict(self.current_checkpoint)
+      existing = [pipe.config[ID] for pipe in self.pipes if
+                  pipe.config[ID] in self.current_checkpoint]
+    if len(existing) != 0 and not force:
       raise ExecutionFailure('A checkpoint already exists')
     if self.pipes is None:
       raise ExecutionFailure('No pipes configured')
-    for pipe in self.pipes:
-      checkpoint = pipe.get_new_checkpoint()
-      if checkpoint is not None:
-        new_checkpoint[pipe.config[ID]] = checkpoint
+    try:
+      for pipe in self.pipes:
+        checkpoint = pipe.get_new_checkpoint()
+        if checkpoint is not None:
+          new_checkpoint[pipe.config[ID]] = checkpoint
+    finally:
+      self.close()
     self.checkpoint_store.save_data(new_checkpoint,
                                     'Initiating a new checkpoint')
 
@@ -267,6 +353,12 @@ class PlumberPlanner(Hooked):
         LOG.log(PLUMBER_LOGS,
                 'Skip checkpointing due to inactivity, error or disabling')
 
+    def finalize(current_result):
+      try:
+        save_new_checkpoint(current_result)
+      finally:
+        self.close()
+
     def main_execution_logic():
       if self.pipes is None:
         raise ExecutionFailure('No pipes configured')
@@ -302,7 +394,7 @@ class PlumberPlanner(Hooked):
           raise e
       return self.results
 
-    return self.wrap_in_hooks(main_execution_logic, save_new_checkpoint)()
+    return self.wrap_in_hooks(main_execution_logic, finalize)()
 
 
 def contains_activity(results):
@@ -314,14 +406,59 @@ def contains_activity(results):
   return False
 
 
-def _create_conditional(config, checkpoint):
+def _is_pipe_selected(config, pipe_ids, tags, excluded_ids):
+  if excluded_ids and config[ID] in excluded_ids:
+    return False
+  if not pipe_ids and not tags:
+    return True
+  if pipe_ids and config[ID] in pipe_ids:
+    return True
+  pipe_tags = get_or_default(config, TAGS, [], list)
+  return bool(tags) and any(tag in pipe_tags for tag in tags)
+
+
+def _get_conditional_type(config):
   if TYPE in config and type(config[TYPE]) is str:
-    if config[TYPE].lower() == LOCALDIFF:
-      conditional = LocalDiffConditional()
-    else:
-      raise ConfigError(
-          'Invalid condition type specified:\n{}'.format(yaml.dump(config)))
-  else:
+    return config[TYPE].lower()
+  return LOCALDIFF
+
+
+def _validate_conditional(config):
+  conditional_type = _get_conditional_type(config)
+  if conditional_type not in (LOCALDIFF, WORKTREE, FILEHASH):
+    raise ConfigError(
+        'Invalid condition type specified:\n{}'.format(yaml.dump(config)))
+  expression = get_or_default(config, EXPRESSION, None, str)
+  if expression is not None:
+    compile_expression(expression)
+
+
+def _create_conditional(config, checkpoint, diff_service=None,
+    conditionals=None):
+  conditional_type = _get_conditional_type(config)
+  key = None
+  if conditionals is not None and conditional_type == LOCALDIFF:
+    key = _get_conditional_key(conditional_type, config, checkpoint)
+    if key in conditionals:
+      conditional = SharedConditional(conditionals[key])
+      conditional.configure(config, checkpoint)
+      return conditional
+  if conditional_type == LOCALDIFF:
     conditional = LocalDiffConditional()
-  conditional.configure(config, checkpoint)
+  elif conditional_type == WORKTREE:
+    conditional = WorktreeConditional()
+  elif conditional_type == FILEHASH:
+    conditional = FileHashConditional()
+  else:
+    raise ConfigError(
+        'Invalid condition type specified:\n{}'.format(yaml.dump(config)))
+  conditional.configure(config, checkpoint, diff_service)
+  if key is not None:
+    conditionals[key] = conditional
   return conditional
+
+
+def _get_conditional_key(conditional_type, config, checkpoint):
+  normalized = {name: value for name, value in config.items() if
+                name not in (ID, TYPE)}
+  return hash_key(conditional_type, normalized, checkpoint)
@@ -0,0 +1,594 @@
+import os
+
+from git import GitCommandError, Repo, InvalidGitRepositoryError, \
+  NoSuchPathError
+
+from plumber.bloom import BloomFilter
+from plumber.cache import DiffCache, StatCache
+from plumber.common import LOG, UTF8, PICKAXE_BATCH_SIZE, current_path, \
+  get_or_default, PATH, MAX_SIZE, DEFAULT_CACHE_MAX_SIZE, ID, \
+  CONTENT_BATCH_SIZE, COMMIT_BATCH_SIZE, DEFAULT_DEEPEN_DEPTH, \
+  DEFAULT_DEEPEN_MAX_DEPTH, DEPTH, MAX_DEPTH, SUBMODULES
+from plumber.documents import parse_document, MISSING, JSON_EXTENSIONS
+from plumber.lfs import parse_lfs_pointer, LFS_POINTER_MAX_SIZE
+from plumber.matchers import PathMatcher, is_under_prefix
+from plumber.objects import ObjectReader
+from plumber.worktree import WorktreeScanner, list_tree_blobs, \
+  list_worktree_files
+
+NULL_OID = '0' * 40
+EMPTY_TREE_OID = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+COMMIT_MARKER = '\x01'
+GITLINK_MODE = '160000'
+
+
+class ChangedPath:
+
+  def __init__(self, path, old_oid=None, new_oid=None, old_mode=None,
+      new_mode=None, source=None):
+    self.path = path
+    self.old_oid = old_oid
+    self.new_oid = new_oid
+    self.old_mode = old_mode
+    self.new_mode = new_mode
+    self.source = source
+
+  def to_list(self):
+    return [self.path, self.old_oid, self.new_oid, self.old_mode,
+            self.new_mode]
+
+
+class DiffService:
+
+  def __init__(self, repo=None, cache_config=None, shallow_config=None):
+    self.repo = repo
+    self.cache_config = cache_config
+    if shallow_config is None:
+      shallow_config = {}
+    self.shallow_config = shallow_config
+    self.deepen_depth = get_or_default(shallow_config, DEPTH,
+                                       DEFAULT_DEEPEN_DEPTH, int)
+    self.deepen_max_depth = get_or_default(shallow_config, MAX_DEPTH,
+                                           DEFAULT_DEEPEN_MAX_DEPTH, int)
+    self.deepened = 0
+    self.cache = None
+    self.objects = None
+    self.head_commit = None
+    self.active_branch = None
+    self.commits = {}
+    self.ancestry = {}
+    self.diffs = {}
+    self.path_matches = {}
+    self.pickaxe_matches = {}
+    self.rule_results = {}
+    self.blooms = {}
+    self.commit_paths = {}
+    self.lfs_pointers = {}
+    self.lfs_attributes = {}
+    self.submodules = {}
+    self.unresolved_submodules = set()
+    self.stat_cache = None
+    self.documents = {}
+    self.worktree_changes = {}
+    self.matcher = PathMatcher()
+
+  def get_repo(self):
+    if self.repo is None:
+      self.repo = open_repo(current_path())
+    return self.repo
+
+  def get_cache_path(self):
+    path = None
+    if self.cache_config is not None:
+      path = get_or_default(self.cache_config, PATH, None, str)
+    if path is None:
+      path = os.path.join(self.get_repo().git_dir, 'plumber', 'cache.sqlite')
+    return path
+
+  def get_cache(self):
+    if self.cache is None and self.cache_config is not None:
+      self.cache = DiffCache(self.get_cache_path(),
+                             get_or_default(self.cache_config, MAX_SIZE,
+                                            DEFAULT_CACHE_MAX_SIZE, int))
+    return self.cache
+
+  def get_stat_cache(self):
+    if self.stat_cache is None:
+      self.stat_cache = StatCache(self.get_cache_path())
+    return self.stat_cache
+
+  def get_object_reader(self):
+    if self.objects is None:
+      self.objects = ObjectReader(self.get_repo())
+    return self.objects
+
+  def close(self):
+    for service in self.submodules.values():
+      if service is not None:
+        service.close()
+    if self.objects is not None:
+      self.objects.close()
+      self.objects = None
+    if self.cache is not None:
+      self.cache.close()
+      self.cache = None
+    if self.stat_cache is not None:
+      self.stat_cache.close()
+      self.stat_cache = None
+
+  def get_head_commit(self):
+    if self.head_commit is None:
+      self.head_commit = str(self.get_repo().head.commit)
+    return self.head_commit
+
+  def get_active_branch(self):
+    if self.active_branch is None:
+      self.active_branch = str(self.get_repo().active_branch)
+    return self.active_branch
+
+  def resolve_commit(self, rev):
+    if rev not in self.commits:
+      self.commits[rev] = resolve_commit(self.get_repo(), rev)
+    return self.commits[rev]
+
+  def is_ancestor(self, base, head):
+    if (base, head) not in self.ancestry:
+      self.ancestry[(base, head)] = is_ancestor(self.get_repo(), base, head)
+    return self.ancestry[(base, head)]
+
+  def get_tree_oids(self, commit, prefixes):
+    oids = {}
+    for prefix in prefixes:
+      header = self.get_object_reader().get_header(
+          '{}:{}'.format(commit, prefix))
+      oids[prefix] = header[0] if header is not None else None
+    return oids
+
+  def get_root_tree(self, commit):
+    header = self.get_object_reader().get_header('{}^{{tree}}'.format(commit))
+    return header[0] if header is not None else None
+
+  def resolve_tree(self, oid):
+    header = self.get_object_reader().get_header(oid)
+    if header is None or header[1] != 'tree':
+      return None
+    return header[0]
+
+  def get_changed_prefixes(self, base, head, prefixes):
+    base_oids = self.get_tree_oids(base, prefixes)
+    head_oids = self.get_tree_oids(head, prefixes)
+    return [prefix for prefix in prefixes if
+            base_oids[prefix] != head_oids[prefix]]
+
+  def is_shallow(self):
+    return self.get_repo().git.rev_parse('--is-shallow-repository') == 'true'
+
+  def write_commit_graph(self):
+    if self.is_shallow():
+      LOG.info('Shallow clone, the commit-graph is not written')
+      return False
+    try:
+      self.get_repo().git.commit_graph('write', '--reachable',
+                                       '--changed-paths')
+      return True
+    except GitCommandError as e:
+      LOG.warning('Could not write the commit-graph: {}'.format(e))
+      return False
+
+  def is_reachable(self, rev, head=None):
+    commit = self.resolve_commit(rev)
+    return commit is not None and (
+        head is None or self.is_ancestor(commit, head))
+
+  def deepen_until(self, rev, head=None):
+    remotes = self.get_repo().remotes
+    while not self.is_reachable(rev, head) and len(
+        remotes) > 0 and self.deepened < self.deepen_max_depth and \
+        self.is_shallow():
+      depth = min(self.deepen_depth, self.deepen_max_depth - self.deepened)
+      LOG.info('Deepening shallow clone by {} commits to reach {}'.format(
+          depth, rev))
+      try:
+        self.get_repo().git.fetch('--deepen={}'.format(depth),
+                                  remotes[0].name)
+      except GitCommandError as e:
+        LOG.warning('Could not deepen the shallow clone: {}'.format(e))
+        break
+      self.deepened += depth
+      self.deepen_depth *= 2
+      self.commits = {}
+      self.ancestry = {}
+    return self.resolve_commit(rev)
+
+  def resolve_branch(self, branch):
+    commit = self.resolve_commit(branch)
+    if commit is None:
+      for remote in self.get_repo().remotes:
+        commit = self.resolve_commit('{}/{}'.format(remote.name, branch))
+        if commit is not None:
+          break
+    return commit
+
+  def get_changes(self, base, head, target=None, pathspecs=None,
+      submodules=False):
+    if pathspecs is not None:
+      pathspecs = tuple(pathspecs)
+    key = (base, head, target, pathspecs, submodules)
+    if key not in self.diffs:
+      full_key = (base, head, target, None, False)
+      if submodules:
+        self.diffs[key] = self._expand_submodules(
+            base, head, self.get_changes(base, head, target, pathspecs))
+      elif pathspecs is not None and full_key in self.diffs:
+        self.diffs[key] = {path: change for path, change in
+                           self.diffs[full_key].items() if
+                           any(is_under_prefix(path, pathspec) for pathspec in
+                               pathspecs)}
+      else:
+        self.diffs[key] = self._compute_changes(base, head, pathspecs)
+    return self.diffs[key]
+
+  def get_worktree_changes(self, pathspecs=None):
+    if pathspecs is not None:
+      pathspecs = tuple(pathspecs)
+    if pathspecs == ():
+      return {}
+    if pathspecs not in self.worktree_changes:
+      repo = self.get_repo()
+      tree = list_tree_blobs(repo, self.get_head_commit(), pathspecs)
+      oids = WorktreeScanner(repo, self.get_stat_cache()).get_oids(
+          list_worktree_files(repo, pathspecs), pathspecs)
+      changes = {}
+      for path, oid in oids.items():
+        if oid is None or tree.get(path) != oid:
+          changes[path] = ChangedPath(path, tree.get(path), oid)
+      for path, oid in tree.items():
+        if path not in oids:
+          changes[path] = ChangedPath(path, oid, None)
+      self.worktree_changes[pathspecs] = changes
+    return self.worktree_changes[pathspecs]
+
+  def get_submodule_service(self, path):
+    if path not in self.submodules:
+      self.submodules[path] = None
+      try:
+        self.submodules[path] = DiffService(
+            open_repo(os.path.join(self.get_repo().working_tree_dir, path)),
+            self.cache_config, self.shallow_config)
+      except (InvalidGitRepositoryError, NoSuchPathError):
+        LOG.warning('Submodule {} is not initialized'.format(path))
+    return self.submodules[path]
+
+  def _resolve_submodule_commit(self, service, path, oid, mode):
+    if oid is None or mode != GITLINK_MODE:
+      return EMPTY_TREE_OID
+    commit = service.resolve_commit(oid)
+    if commit is None:
+      LOG.warning('Commit {} of submodule {} not found'.format(oid, path))
+    return commit
+
+  def _expand_submodules(self, base, head, changes):
+    expanded = {}
+    for path, change in changes.items():
+      inner_changes = None
+      if GITLINK_MODE in (change.old_mode, change.new_mode):
+        inner_changes = self._get_submodule_changes(change)
+        if inner_changes is None:
+          self.unresolved_submodules.add((base, head))
+      if inner_changes is None:
+        expanded[path] = change
+      else:
+        expanded.update(inner_changes)
+    return expanded
+
+  def _get_submodule_changes(self, change):
+    service = self.get_submodule_service(change.path)
+    if service is None:
+      return None
+    base = self._resolve_submodule_commit(service, change.path,
+                                          change.old_oid, change.old_mode)
+    head = self._resolve_submodule_commit(service, change.path,
+                                          change.new_oid, change.new_mode)
+    if base is None or head is None:
+      return None
+    LOG.debug('Expanding submodule {} {}..{}'.format(change.path, base, head))
+    inner_changes = {}
+    changes = service.get_changes(base, head, submodules=True)
+    if (base, head) in service.unresolved_submodules:
+      return None
+    for path, inner in changes.items():
+      inner_path = '{}/{}'.format(change.path, path)
+      inner_changes[inner_path] = ChangedPath(
+          inner_path, inner.old_oid, inner.new_oid, inner.old_mode,
+          inner.new_mode, inner.source or (service, base, head, path))
+    return inner_changes
+
+  def _compute_changes(self, base, head, pathspecs):
+    cache = self.get_cache()
+    if cache is not None:
+      cached = cache.get_changes(base, head, pathspecs)
+      if cached is not None:
+        LOG.debug('Diff {}..{} found in cache'.format(base, head))
+        return {item[0]: ChangedPath(*item) for item in cached}
+    LOG.debug('Computing diff {}..{} {}'.format(base, head, pathspecs or ''))
+    changes = diff_range(self.get_repo(), base, head, pathspecs)
+    if cache is not None:
+      cache.save_changes(base, head, pathspecs,
+                         [change.to_list() for change in changes.values()])
+    return changes
+
+  def _get_rule_key(self, base, head, rule):
+    pattern = {key: value for key, value in rule.items() if key != ID}
+    return (base, head, repr(sorted(pattern.items()))), pattern
+
+  def has_rule_result(self, base, head, rule):
+    key, pattern = self._get_rule_key(base, head, rule)
+    if key not in self.rule_results:
+      cache = self.get_cache()
+      if cache is None:
+        return False
+      result = cache.get_match(base, head, pattern)
+      if result is None:
+        return False
+      self.rule_results[key] = result
+    return True
+
+  def get_rule_result(self, base, head, rule, evaluate):
+    key, pattern = self._get_rule_key(base, head, rule)
+    if key not in self.rule_results:
+      cache = self.get_cache()
+      result = None
+      if cache is not None:
+        result = cache.get_match(base, head, pattern)
+      if result is None:
+        result = evaluate()
+        if cache is not None and not (rule.get(SUBMODULES) and (
+            base, head) in self.unresolved_submodules):
+          cache.save_match(base, head, pattern, result)
+      self.rule_results[key] = result
+    return self.rule_results[key]
+
+  def get_object_size(self, oid):
+    header = self.get_object_reader().get_header(oid)
+    if header is None:
+      return 0
+    return header[2]
+
+  def read_blob(self, oid):
+    if oid is None:
+      return b''
+    item = self.get_object_reader().read(oid)
+    if item is None:
+      return b''
+    return item[1]
+
+  def get_document(self, oid, path):
+    if oid is None:
+      return MISSING
+    key = (oid, path.endswith(JSON_EXTENSIONS))
+    if key not in self.documents:
+      LOG.debug('Parsing {} {}'.format(path, oid))
+      self.documents[key] = parse_document(self.read_blob(oid), path)
+    return self.documents[key]
+
+  def get_lfs_pointer(self, oid):
+    if oid is None:
+      return None
+    if oid not in self.lfs_pointers:
+      self.lfs_pointers[oid] = None
+      if self.get_object_size(oid) <= LFS_POINTER_MAX_SIZE:
+        self.lfs_pointers[oid] = parse_lfs_pointer(self.read_blob(oid))
+    return self.lfs_pointers[oid]
+
+  def get_lfs_paths(self, paths):
+    missing = [path for path in set(paths) if path not in self.lfs_attributes]
+    for i in range(0, len(missing), CONTENT_BATCH_SIZE):
+      self.lfs_attributes.update(
+          check_lfs_attributes(self.get_repo(),
+                               missing[i:i + CONTENT_BATCH_SIZE]))
+    return {path for path in paths if self.lfs_attributes.get(path)}
+
+  def is_lfs_path(self, path):
+    return len(self.get_lfs_paths([path])) > 0
+
+  def is_lfs_object(self, change, path):
+    if not self.is_lfs_path(path):
+      return False
+    return self.get_lfs_pointer(change.old_oid) is not None or \
+           self.get_lfs_pointer(change.new_oid) is not None
+
+  def is_lfs_unchanged(self, change, path):
+    if not self.is_lfs_path(path):
+      return False
+    pointer = self.get_lfs_pointer(change.new_oid)
+    return pointer is not None and pointer == self.get_lfs_pointer(
+        change.old_oid)
+
+  def iter_changed_lines(self, base, head, paths):
+    for i in range(0, len(paths), CONTENT_BATCH_SIZE):
+      yield from iter_changed_lines(self.get_repo(), base, head,
+                                    paths[i:i + CONTENT_BATCH_SIZE])
+
+  def has_pickaxe_match(self, base, head, regex, paths):
+    key = (base, head, regex, tuple(paths))
+    if key not in self.pickaxe_matches:
+      self.pickaxe_matches[key] = False
+      for i in range(0, len(paths), PICKAXE_BATCH_SIZE):
+        if len(pickaxe(self.get_repo(), base, head, regex,
+                       paths[i:i + PICKAXE_BATCH_SIZE])) > 0:
+          self.pickaxe_matches[key] = True
+          break
+    return self.pickaxe_matches[key]
+
+  def get_commit_filters(self, commits):
+    cache = self.get_cache()
+    missing = []
+    for commit in commits:
+      if commit not in self.blooms and cache is not None:
+        data = cache.get_bloom(commit)
+        if data is not None:
+          self.blooms[commit] = BloomFilter(data)
+      if commit not in self.blooms:
+        missing.append(commit)
+    if len(missing) > 0:
+      LOG.debug('Indexing changed paths of {} commits'.format(len(missing)))
+    for i in range(0, len(missing), COMMIT_BATCH_SIZE):
+      changes = changed_paths_by_commit(self.get_repo(),
+                                        missing[i:i + COMMIT_BATCH_SIZE])
+      for commit in missing[i:i + COMMIT_BATCH_SIZE]:
+        self.commit_paths[commit] = changes.get(commit, [])
+        bloom = BloomFilter.from_paths(self.commit_paths[commit])
+        self.blooms[commit] = bloom
+        if cache is not None:
+          cache.save_bloom(commit, bloom.to_bytes())
+    return {commit: self.blooms[commit] for commit in commits}
+
+  def get_touching_commits(self, base, head, paths):
+    commits = list_commits(self.get_repo(), base, head)
+    filters = self.get_commit_filters(commits)
+    candidates = [commit for commit in commits if
+                  any(filters[commit].might_contain(path) for path in paths)]
+    LOG.debug('{} of {} commits may touch {} paths'.format(
+        len(candidates), len(commits), len(paths)))
+    paths = set(paths)
+    missing = [commit for commit in candidates if
+               commit not in self.commit_paths]
+    for i in range(0, len(missing), COMMIT_BATCH_SIZE):
+      changes = changed_paths_by_commit(self.get_repo(),
+                                        missing[i:i + COMMIT_BATCH_SIZE])
+      for commit in missing[i:i + COMMIT_BATCH_SIZE]:
+        self.commit_paths[commit] = changes.get(commit, [])
+    touching = set(commit for commit in candidates if
+                   not paths.isdisjoint(self.commit_paths[commit]))
+    return [commit for commit in candidates if commit in touching]
+
+  def get_path_matches(self, base, head, target=None, pathspecs=None,
+      submodules=False):
+    key = (base, head, target,
+           tuple(pathspecs) if pathspecs is not None else None, submodules,
+           len(self.matcher.patterns))
+    if key not in self.path_matches:
+      self.path_matches[key] = self.matcher.match_paths(
+          self.get_changes(base, head, target, pathspecs, submodules))
+    return self.path_matches[key]
+
+
+def open_repo(path):
+  repo = Repo(path)
+  repo.git.update_environment(GIT_LFS_SKIP_SMUDGE='1')
+  return repo
+
+
+def resolve_commit(repo, rev):
+  try:
+    return repo.git.rev_parse('--verify', '--quiet',
+                              '{}^{{commit}}'.format(rev))
+  except GitCommandError:
+    LOG.debug('Could not resolve {} to a commit'.format(rev))
+    return None
+
+
+def is_ancestor(repo, base, head):
+  try:
+    repo.git.merge_base('--is-ancestor', base, head)
+    return True
+  except GitCommandError as e:
+    if e.status == 1:
+      return False
+    raise
+
+
+def diff_range(repo, base, head, pathspecs=None):
+  if pathspecs is not None and len(pathspecs) == 0:
+    return {}
+  args = ['-r', '-z', '--raw', '--no-renames', '--no-abbrev', base, head]
+  if pathspecs is not None:
+    args.append('--')
+    args.extend(':(top,literal){}'.format(pathspec) for pathspec in pathspecs)
+  return parse_raw_diff(repo.git.diff_tree(*args))
+
+
+def iter_changed_lines(repo, base, head, paths):
+  process = repo.git.diff('--no-color', '--no-ext-diff', '--no-textconv',
+                          '--no-renames', '--unified=0', base, head, '--',
+                          *(':(top,literal){}'.format(path) for path in paths),
+                          as_process=True)
+  try:
+    in_hunk = False
+    for line in process.stdout:
+      if line.startswith(b'diff --git '):
+        in_hunk = False
+      elif line.startswith(b'@@'):
+        in_hunk = True
+      elif in_hunk and line[:1] in (b'+', b'-'):
+        yield line[1:].rstrip(b'\r\n').decode(UTF8, errors='replace')
+  finally:
+    if process.proc.poll() is None:
+      process.proc.kill()
+    process.proc.wait()
+
+
+def check_lfs_attributes(repo, paths):
+  output = repo.git.check_attr('-z', 'filter', '--', *paths)
+  fields = output.split('\0')
+  return {fields[i]: fields[i + 2] == 'lfs' for i in
+          range(0, len(fields) - 2, 3)}
+
+
+def pickaxe(repo, base, head, regex, paths):
+  output = repo.git.diff('--name-only', '-z', '--no-renames', '--no-ext-diff',
+                         '--no-textconv', '-G{}'.format(regex), base, head,
+                         '--', *(':(top,literal){}'.format(path) for path in
+                                 paths))
+  return [path for path in output.split('\0') if path]
+
+
+def list_commits(repo, base, head):
+  output = repo.git.rev_list('{}..{}'.format(base, head))
+  return [commit for commit in output.split('\n') if commit]
+
+
+def changed_paths_by_commit(repo, commits):
+  args = ['--no-walk=unsorted', '--format={}%H'.format(COMMIT_MARKER), '-z',
+          '--name-only', '--no-renames', '-m', '--first-parent']
+  args.extend(commits)
+  return parse_log_paths(repo.git.log(*args))
+
+
+def parse_log_paths(output):
+  changes = {}
+  paths = None
+  header = False
+  for token in output.split('\0'):
+    if token.startswith(COMMIT_MARKER):
+      paths = changes.setdefault(token[len(COMMIT_MARKER):], [])
+      header = True
+      continue
+    if header and token.startswith('\n'):
+      token = token[1:]
+    header = False
+    if paths is not None and token:
+      paths.append(token)
+  return changes
+
+
+def parse_raw_diff(output):
+  changes = {}
+  tokens = output.split('\0')
+  for i in range(0, len(tokens) - 1, 2):
+    meta = tokens[i].lstrip(':').split(' ')
+    if len(meta) < 5:
+      continue
+    path = tokens[i + 1]
+    changes[path] = ChangedPath(path,
+                                old_oid=_oid_or_none(meta[2]),
+                                new_oid=_oid_or_none(meta[3]),
+                                old_mode=meta[0],
+                                new_mode=meta[1])
+  return changes
+
+
+def _oid_or_none(oid):
+  if oid == NULL_OID:
+    return None
+  return oid
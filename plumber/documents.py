@@ -0,0 +1,35 @@
+import json
+
+import yaml
+
+from plumber.common import UTF8
+
+MISSING = object()
+INVALID = object()
+JSON_EXTENSIONS = ('.json',)
+
+
+def parse_document(data, path):
+  try:
+    text = data.decode(UTF8)
+    if path.endswith(JSON_EXTENSIONS):
+      return json.loads(text)
+    documents = list(yaml.safe_load_all(text))
+  except (UnicodeDecodeError, ValueError, yaml.YAMLError):
+    return INVALID
+  if len(documents) == 1:
+    return documents[0]
+  return documents
+
+
+def get_key_path(document, key):
+  value = document
+  for segment in key.split('.'):
+    if type(value) is dict and segment in value:
+      value = value[segment]
+    elif type(value) is list and segment.isdigit() and int(segment) < len(
+        value):
+      value = value[int(segment)]
+    else:
+      return MISSING
+  return value
@@ -1,5 +1,7 @@
 from abc import ABCMeta, abstractmethod
 
+from plumber.common import COST_PATH
+
 
 class DataStore:
   __metaclass__ = ABCMeta
@@ -33,3 +35,9 @@ class Conditional:
   @abstractmethod
   def configure(self, config, checkpoint):
     pass
+
+  def prepare(self):
+    return True
+
+  def get_cost(self):
+    return COST_PATH
@@ -0,0 +1,21 @@
+from plumber.common import UTF8
+
+LFS_POINTER_VERSION = b'version https://git-lfs.github.com/spec/v1\n'
+LFS_POINTER_MAX_SIZE = 1024
+
+
+def parse_lfs_pointer(data):
+  if len(data) > LFS_POINTER_MAX_SIZE or not data.startswith(
+      LFS_POINTER_VERSION):
+    return None
+  fields = {}
+  try:
+    for line in data.decode(UTF8).splitlines()[1:]:
+      key, _, value = line.partition(' ')
+      fields[key] = value
+  except UnicodeDecodeError:
+    return None
+  if not fields.get('oid', '').startswith('sha256:') or not fields.get(
+      'size', '').isdigit():
+    return None
+  return fields['oid'], int(fields['size'])
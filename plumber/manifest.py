@@ -0,0 +1,73 @@
+import hashlib
+import os
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from plumber.common import LOG, UTF8
+
+HASH_CHUNK_SIZE = 1024 * 1024
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+def scan_directory(root):
+  stats = {}
+  for directory, directories, files in os.walk(root):
+    directories.sort()
+    for name in files:
+      path = os.path.join(directory, name)
+      try:
+        path_stat = os.lstat(path)
+      except OSError:
+        continue
+      if stat.S_ISREG(path_stat.st_mode) or stat.S_ISLNK(path_stat.st_mode):
+        stats[os.path.relpath(path, root).replace(os.sep, '/')] = path_stat
+  return stats
+
+
+def hash_file(path):
+  digest = hashlib.sha256()
+  try:
+    if os.path.islink(path):
+      digest.update(os.readlink(path).encode(UTF8))
+    else:
+      with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+          digest.update(chunk)
+  except OSError as e:
+    LOG.warning('Could not hash {}: {}'.format(path, e))
+    return None
+  return digest.hexdigest()
+
+
+def build_manifest(root, previous=None, scanned=None, workers=None):
+  if previous is None:
+    previous = {}
+  scan_start = time.time_ns()
+  stats = scan_directory(root)
+  manifest = {}
+  missing = []
+  for path, path_stat in stats.items():
+    entry = previous.get(path)
+    if entry is not None and entry[0] == path_stat.st_size and entry[
+      1] == path_stat.st_mtime_ns and (
+        scanned is None or path_stat.st_mtime_ns < scanned - RACY_WINDOW_NS):
+      manifest[path] = entry
+    else:
+      missing.append(path)
+  LOG.debug('Hashing {} of {} files in {}'.format(len(missing), len(stats),
+                                                  root))
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for path, digest in zip(missing, executor.map(
+        lambda item: hash_file(os.path.join(root, item)), missing)):
+      if digest is not None:
+        manifest[path] = [stats[path].st_size, stats[path].st_mtime_ns,
+                          digest]
+  return manifest, scan_start
+
+
+def diff_manifests(old, new):
+  changed = [path for path, entry in new.items() if
+             path not in old or old[path][2] != entry[2]]
+  changed.extend(path for path in old if path not in new)
+  return sorted(changed)
@@ -0,0 +1,163 @@
+import re
+
+from plumber.common import ConfigError
+
+REGEX_SPECIAL_CHARS = '.^$*+?{}[]\\|()'
+REGEX_QUANTIFIERS = '*+?{'
+PREFIX_SUFFIXES = ('', '.*')
+NON_ERE_SYNTAX = re.compile(r'\\[0-9A-Za-z]|\(\?|[*+?}]\?|\[[^\]]*\\')
+
+
+def literal_prefix(pattern):
+  return split_literal_prefix(pattern)[0]
+
+
+def split_literal_prefix(pattern):
+  if _has_top_level_alternation(pattern):
+    return '', pattern
+  index = 1 if pattern.startswith('^') else 0
+  prefix = []
+  while index < len(pattern):
+    char = pattern[index]
+    if char == '\\':
+      if index + 1 >= len(pattern) or pattern[index + 1].isalnum():
+        break
+      literal = pattern[index + 1]
+      end = index + 2
+    elif char in REGEX_SPECIAL_CHARS:
+      break
+    else:
+      literal = char
+      end = index + 1
+    if end < len(pattern) and pattern[end] in REGEX_QUANTIFIERS:
+      break
+    prefix.append(literal)
+    index = end
+  return ''.join(prefix), pattern[index:]
+
+
+def directory_prefix(pattern):
+  prefix = literal_prefix(pattern)
+  if '/' not in prefix:
+    return None
+  return prefix[:prefix.rindex('/')]
+
+
+def to_pathspecs(patterns):
+  prefixes = set()
+  for pattern in patterns:
+    prefix = directory_prefix(pattern)
+    if prefix is None:
+      return None
+    prefixes.add(prefix)
+  pathspecs = []
+  for prefix in sorted(prefixes):
+    if len(pathspecs) == 0 or not is_under_prefix(prefix, pathspecs[-1]):
+      pathspecs.append(prefix)
+  return pathspecs
+
+
+def is_under_prefix(path, prefix):
+  return path == prefix or path.startswith(prefix + '/')
+
+
+def to_pickaxe_regex(pattern):
+  if NON_ERE_SYNTAX.search(pattern):
+    return None
+  if _has_top_level_alternation(pattern):
+    pattern = '({})'.format(pattern)
+  if not pattern.startswith('^'):
+    pattern = '^' + pattern
+  return pattern
+
+
+def _has_top_level_alternation(pattern):
+  depth = 0
+  index = 0
+  in_class = False
+  while index < len(pattern):
+    char = pattern[index]
+    if char == '\\':
+      index += 2
+      continue
+    if in_class:
+      if char == ']':
+        in_class = False
+    elif char == '[':
+      in_class = True
+    elif char == '(':
+      depth += 1
+    elif char == ')':
+      depth -= 1
+    elif char == '|' and depth == 0:
+      return True
+    index += 1
+  return False
+
+
+class PathMatcher:
+
+  def __init__(self):
+    self.patterns = []
+    self.ids = {}
+    self.prefixes = None
+    self.regexes = None
+    self.masks = {}
+
+  def register(self, pattern):
+    if pattern not in self.ids:
+      try:
+        re.compile(pattern)
+      except re.error as e:
+        raise ConfigError('Invalid path pattern {}'.format(pattern), e)
+      self.ids[pattern] = len(self.patterns)
+      self.patterns.append(pattern)
+      self.prefixes = None
+      self.masks = {}
+    return self.ids[pattern]
+
+  def compile(self):
+    self.prefixes = {}
+    self.regexes = {}
+    for pattern_id, pattern in enumerate(self.patterns):
+      prefix, rest = split_literal_prefix(pattern)
+      directory = prefix[:prefix.rindex('/')] if '/' in prefix else ''
+      if rest in PREFIX_SUFFIXES:
+        self.prefixes.setdefault(directory, []).append((prefix, pattern_id))
+      else:
+        self.regexes.setdefault(directory, []).append(
+            (re.compile(pattern), pattern_id))
+
+  def match(self, path):
+    if self.prefixes is None:
+      self.compile()
+    mask = self.masks.get(path)
+    if mask is None:
+      mask = 0
+      for directory in _directories(path):
+        for prefix, pattern_id in self.prefixes.get(directory, ()):
+          if path.startswith(prefix):
+            mask |= 1 << pattern_id
+        for regex, pattern_id in self.regexes.get(directory, ()):
+          if regex.match(path):
+            mask |= 1 << pattern_id
+      self.masks[path] = mask
+    return mask
+
+  def match_paths(self, paths):
+    matched = 0
+    masks = {}
+    for path in paths:
+      mask = self.match(path)
+      if mask:
+        masks[path] = mask
+        matched |= mask
+    return matched, masks
+
+
+def _directories(path):
+  yield ''
+  index = path.find('/')
+  while index != -1:
+    yield path[:index]
+    index = path.find('/', index + 1)
@@ -0,0 +1,74 @@
+import subprocess
+from collections import OrderedDict
+
+from plumber.common import LOG, UTF8, DEFAULT_OBJECT_CACHE_SIZE
+
+BATCH = '--batch'
+BATCH_CHECK = '--batch-check'
+OBJECT_TYPES = ('blob', 'tree', 'commit', 'tag')
+
+
+class ObjectReader:
+
+  def __init__(self, repo, max_cache_size=DEFAULT_OBJECT_CACHE_SIZE):
+    self.repo = repo
+    self.max_cache_size = max_cache_size
+    self.processes = {}
+    self.headers = {}
+    self.objects = OrderedDict()
+    self.cache_size = 0
+
+  def _get_process(self, option):
+    process = self.processes.get(option)
+    if process is None:
+      LOG.debug('Starting git cat-file {}'.format(option))
+      process = self.repo.git.cat_file(option, as_process=True,
+                                       istream=subprocess.PIPE)
+      self.processes[option] = process
+    return process
+
+  def _request(self, option, name):
+    process = self._get_process(option)
+    process.stdin.write('{}\n'.format(name).encode(UTF8))
+    process.stdin.flush()
+    header = process.stdout.readline().decode(UTF8).rstrip('\n').rsplit(' ', 2)
+    if len(header) != 3 or header[1] not in OBJECT_TYPES or not header[
+      2].isdigit():
+      return process, None
+    return process, (header[0], header[1], int(header[2]))
+
+  def get_header(self, name):
+    if name not in self.headers:
+      self.headers[name] = self._request(BATCH_CHECK, name)[1]
+    return self.headers[name]
+
+  def read(self, name):
+    header = self.get_header(name)
+    if header is None:
+      return None
+    oid, object_type, size = header
+    if oid in self.objects:
+      self.objects.move_to_end(oid)
+      return object_type, self.objects[oid]
+    process, header = self._request(BATCH, oid)
+    if header is None:
+      return None
+    data = process.stdout.read(size)
+    process.stdout.read(1)
+    self._cache(oid, data)
+    return object_type, data
+
+  def _cache(self, oid, data):
+    if len(data) > self.max_cache_size:
+      return
+    self.objects[oid] = data
+    self.cache_size += len(data)
+    while self.cache_size > self.max_cache_size:
+      _, evicted = self.objects.popitem(last=False)
+      self.cache_size -= len(evicted)
+
+  def close(self):
+    for process in self.processes.values():
+      process.stdin.close()
+      process.wait()
+    self.processes = {}
@@ -1,13 +1,22 @@
+import functools
+import logging
+import os
 import re
 import subprocess
 
 import yaml
-from git import Repo
 
-from plumber.common import current_path, LOG, evaluate_expression, ConfigError, \
+from plumber.common import LOG, compile_expression, ConfigError, \
   ExecutionFailure, DIFF, BRANCH, ACTIVE, TARGET, EXPRESSION, COMMIT, ID, PATH, \
   STEPS, BATCH, TIMEOUT, RETURN_CODE, STEP, STDOUT, STDERR, get_or_default, \
-  create_execution_log, UTF8, PLUMBER_LOGS, CONTENT
+  create_execution_log, UTF8, PLUMBER_LOGS, CONTENT, MAX_SIZE, \
+  DEFAULT_CONTENT_MAX_SIZE, PICKAXE, CHECKPOINT, TREE, PREFIXES, SUBMODULES, \
+  WORKTREE, FILEHASH, FILES, SCANNED, WORKERS, KEYS, COST_CACHED, COST_PATH, \
+  COST_CONTENT, COST_TARGET_BRANCH, COST_SCAN
+from plumber.diffs import DiffService, GITLINK_MODE
+from plumber.documents import get_key_path, INVALID
+from plumber.manifest import build_manifest, diff_manifests
+from plumber.matchers import to_pathspecs, to_pickaxe_regex, PathMatcher
 from plumber.interfaces import Conditional
 
 
@@ -17,14 +26,20 @@ class LocalDiffConditional(Conditional):
     self.target_diffs = None
     self.active_branch = None
     self.target_branch = None
-    self.repo = None
+    self.diff_service = None
     self.checkpoint = None
     self.expression = None
+    self.compiled_expression = None
     self.result = None
     self.id = None
     self.new_checkpoint = None
+    self.pathspecs = None
+    self.diff_range = None
+    self.checkpoint_format = None
+    self.base_commit = None
+    self.submodules = False
 
-  def configure(self, config, checkpoint):
+  def configure(self, config, checkpoint, diff_service=None):
     self.id = get_or_default(config, ID, None, str)
     if self.id is None:
       raise ConfigError('id not specified:\n{}'.format(yaml.dump(config)))
@@ -33,89 +48,400 @@ class LocalDiffConditional(Conditional):
       raise ConfigError(
           'No diffs specified in the localdiff condition:\n{}'.format(
               yaml.dump(config)))
+    for target_diff in self.target_diffs:
+      if type(target_diff) is dict and get_or_default(
+          target_diff, KEYS, None, list) is not None and CONTENT in target_diff:
+        raise ConfigError(
+            'content and keys can not be combined in a diff:\n{}'.format(
+                yaml.dump(target_diff)))
 
     branches = get_or_default(config, BRANCH, None, dict)
     if branches is not None:
       self.active_branch = get_or_default(branches, ACTIVE, None, str)
       self.target_branch = get_or_default(branches, TARGET, None, str)
-    self.repo = Repo(current_path())
-    self.new_checkpoint = str(self.repo.head.commit)
+    if diff_service is None:
+      diff_service = DiffService()
+    self.diff_service = diff_service
     self.checkpoint = checkpoint
     self.expression = get_or_default(config, EXPRESSION, None, str)
+    if self.expression is not None:
+      self.compiled_expression = compile_expression(self.expression)
+    self.checkpoint_format = get_or_default(config, CHECKPOINT, COMMIT, str)
+    if self.checkpoint_format not in (COMMIT, TREE):
+      raise ConfigError(
+          'Invalid checkpoint format {}, expected {} or {}'.format(
+              self.checkpoint_format, COMMIT, TREE))
+    self.submodules = get_or_default(config, SUBMODULES, False, bool)
+    self._register_path_patterns()
 
   def evaluate(self):
     if self.result is None:
-      if self.active_branch is not None and str(
-          self.repo.active_branch) != self.active_branch:
+      self._resolve_new_checkpoint()
+      if self.active_branch is not None and \
+          self.diff_service.get_active_branch() != self.active_branch:
         LOG.info(
             '[{}] Not on active branch, conditional disabled'.format(self.id))
         self.result = False
         return self.result
-      if self.target_branch is not None and str(
-          self.repo.active_branch) != self.target_branch:
-        previous_branch = str(self.repo.active_branch)
-        try:
-          LOG.info('[{}] checking out target branch {}'.format(self.id,
-                                                               self.target_branch))
-          self.repo.git.checkout(self.target_branch)
-          self.result = self._has_diff()
-        finally:
-          self.repo.git.checkout(previous_branch)
-      else:
-        self.result = self._has_diff()
+      self.result = self._has_diff()
+      if self.result and LOG.isEnabledFor(logging.INFO):
+        self._log_touching_commits()
     return self.result
 
+  def get_cost(self):
+    if self.result is not None:
+      return COST_CACHED
+    cost = COST_PATH
+    if any(type(target_diff) is dict and (
+        CONTENT in target_diff or KEYS in target_diff) for target_diff in
+           self.target_diffs or []):
+      cost = COST_CONTENT
+    if self.target_branch is not None:
+      cost += COST_TARGET_BRANCH
+    return cost
+
+  def prepare(self):
+    if COMMIT not in self.checkpoint:
+      return True
+    if self._resolve_checkpoint_commit(self._resolve_head()) is None:
+      LOG.warning('[{}] checkpoint commit {} not found'.format(
+          self.id, self.checkpoint[COMMIT]))
+      return False
+    LOG.info('[{}] checkpoint commit {} found'.format(
+        self.id, self.checkpoint[COMMIT]))
+    return True
+
+  def _resolve_checkpoint_commit(self, head):
+    commit = self.checkpoint[COMMIT]
+    if not self.diff_service.is_reachable(commit, head) and \
+        self.diff_service.is_shallow():
+      LOG.info('[{}] checkpoint commit {} not reachable in shallow clone'.format(
+          self.id, commit))
+      return self.diff_service.deepen_until(commit, head)
+    return self.diff_service.resolve_commit(commit)
+
+  def _resolve_new_checkpoint(self):
+    if self.new_checkpoint is None:
+      self.new_checkpoint = self.diff_service.get_head_commit()
+    return self.new_checkpoint
+
   def create_checkpoint(self):
+    self._resolve_new_checkpoint()
     LOG.info(
         '[{}] New checkpoint {}'.format(self.id, self.new_checkpoint))
-    return {COMMIT: self.new_checkpoint}
+    checkpoint = {COMMIT: self.new_checkpoint}
+    if self.checkpoint_format == TREE:
+      checkpoint[TREE] = self.diff_service.get_root_tree(self.new_checkpoint)
+      if self.pathspecs is not None and len(self.pathspecs) > 0:
+        checkpoint[PREFIXES] = self.diff_service.get_tree_oids(
+            self.new_checkpoint, self.pathspecs)
+    return checkpoint
 
-  def _get_diffs_from_current(self):
+  def _has_checkpoint(self):
+    return COMMIT in self.checkpoint or TREE in self.checkpoint
+
+  def _register_path_patterns(self):
+    patterns = []
+    for target_diff in self.target_diffs:
+      if type(target_diff) is dict and type(target_diff.get(PATH)) is str:
+        self.diff_service.matcher.register(target_diff[PATH])
+        patterns.append(target_diff[PATH])
+    if self.submodules:
+      self.pathspecs = None
+    else:
+      self.pathspecs = to_pathspecs(patterns)
+
+  def _get_diff_range(self):
+    if self.diff_range is None:
+      self.diff_range = self._resolve_diff_range()
+    return self.diff_range
+
+  def _resolve_diff_range(self):
+    head = self._resolve_head()
+    if TREE in self.checkpoint:
+      diff_range = self._resolve_tree_diff_range(head)
+      if diff_range is not None:
+        return diff_range
     if COMMIT not in self.checkpoint:
       return None
-    found_diffs = list()
-    commit_found = False
-    for commit in self.repo.iter_commits():
-      diffs = self.repo.head.commit.diff(commit)
-      for diff in diffs:
-        found_diffs.append(diff)
-      commit_found = str(commit) == self.checkpoint[COMMIT]
-      if commit_found:
-        break
-    if not commit_found:
-      LOG.warn(
-          '[{}] traversed all git log, checkpoint commit not found'.format(
-              self.id))
-    LOG.info(
-        '[{}] detected diffs since last run:\n{}\n'.format(self.id, ''.join(
-            f'\n\t {l.a_rawpath.decode(UTF8)}' for l in found_diffs)))
-    return found_diffs
+    base = self._resolve_checkpoint_commit(head)
+    if base is None:
+      LOG.warning('[{}] checkpoint commit {} not found'.format(
+          self.id, self.checkpoint[COMMIT]))
+      return None
+    if self.diff_service.is_ancestor(base, head):
+      self.base_commit = base
+    else:
+      LOG.warning(
+          '[{}] checkpoint commit {} is not an ancestor of {}, comparing the '
+          'trees directly'.format(self.id, base, head))
+    return base, head, self.target_branch, self._narrow_pathspecs(base,
+                                                                  head), \
+           self.submodules
+
+  def _resolve_head(self):
+    if self.target_branch is not None:
+      LOG.info('[{}] evaluating target branch {}'.format(self.id,
+                                                         self.target_branch))
+      head = self.diff_service.resolve_branch(self.target_branch)
+      if head is None:
+        raise ExecutionFailure(
+            '[{}] target branch {} not found'.format(self.id,
+                                                     self.target_branch))
+      return head
+    return self.diff_service.get_head_commit()
+
+  def _resolve_tree_diff_range(self, head):
+    base = self.diff_service.resolve_tree(self.checkpoint[TREE])
+    if base is not None:
+      return base, head, self.target_branch, self._narrow_pathspecs(base,
+                                                                    head), \
+             self.submodules
+    prefixes = self.checkpoint.get(PREFIXES)
+    if self.pathspecs is None or type(prefixes) is not dict or any(
+        pathspec not in prefixes for pathspec in self.pathspecs):
+      LOG.warning('[{}] checkpoint tree {} not found'.format(
+          self.id, self.checkpoint[TREE]))
+      return None
+    head_oids = self.diff_service.get_tree_oids(head, self.pathspecs)
+    if any(prefixes[pathspec] != head_oids[pathspec] for pathspec in
+           self.pathspecs):
+      LOG.warning(
+          '[{}] checkpoint tree {} not found and watched paths changed'.format(
+              self.id, self.checkpoint[TREE]))
+      return None
+    LOG.info('[{}] no changes under {}'.format(self.id,
+                                               ', '.join(self.pathspecs)))
+    return self.checkpoint[TREE], head, self.target_branch, [], \
+           self.submodules
+
+  def _narrow_pathspecs(self, base, head):
+    pathspecs = self.pathspecs
+    if pathspecs is not None and len(pathspecs) > 0:
+      pathspecs = self.diff_service.get_changed_prefixes(base, head,
+                                                         pathspecs)
+      if len(pathspecs) < len(self.pathspecs):
+        LOG.info('[{}] no changes under {}'.format(self.id, ', '.join(
+            set(self.pathspecs).difference(pathspecs))))
+    return pathspecs
+
+  def _get_diffs_from_current(self):
+    if not self._has_checkpoint():
+      return None
+    diff_range = self._get_diff_range()
+    if diff_range is None:
+      return None
+    return self.diff_service.get_changes(*diff_range)
 
   def _has_diff(self):
-    if COMMIT not in self.checkpoint:
+    if not self._has_checkpoint():
       LOG.warning('[{}] no checkpoint found, pipe will be executed')
       return True
+    diff_range = self._get_diff_range()
+    if diff_range is None:
+      LOG.warning(
+          '[{}] checkpoint could not be resolved, pipe will be executed'.format(
+              self.id))
+      return True
+    if LOG.isEnabledFor(logging.INFO):
+      LOG.info(
+          '[{}] detected diffs since last run:\n{}\n'.format(self.id, ''.join(
+              f'\n\t {l}' for l in self.diff_service.get_changes(
+                  *diff_range))))
     if self.expression is not None:
       LOG.info(
           '[{}] detecting through expression evaluation: {}'.format(self.id,
                                                                     self.expression))
-      return self._has_diff_expression()
+      return self._has_diff_expression(diff_range)
     else:
       LOG.info('[{}] detecting any of the diffs'.format(self.id))
-      return self._has_diff_all()
-
-  def _has_content_diff(self, pattern, diff):
-    diff_lines = set(
-        diff.a_blob.data_stream.read().decode(UTF8).split('\n')).difference(
-        set(diff.b_blob.data_stream.read().decode(UTF8).split('\n')))
-    for item in diff_lines:
-      if re.match(pattern, item):
+      return self._has_diff_all(diff_range)
+
+  def _log_touching_commits(self):
+    if self.base_commit is None:
+      return
+    diff_range = self._get_diff_range()
+    pattern_mask = 0
+    for target_diff in self.target_diffs:
+      if type(target_diff) is dict and type(target_diff.get(PATH)) is str:
+        pattern_mask |= 1 << self.diff_service.matcher.register(
+            target_diff[PATH])
+    paths = [path for path, mask in
+             self.diff_service.get_path_matches(*diff_range)[1].items() if
+             mask & pattern_mask]
+    if len(paths) > 0:
+      try:
+        commits = self.diff_service.get_touching_commits(self.base_commit,
+                                                         diff_range[1], paths)
+      except Exception as e:
+        LOG.warning('[{}] could not list the commits changing the matched '
+                    'paths: {}'.format(self.id, e))
+        return
+      LOG.info('[{}] matched paths were changed by commits:\n{}\n'.format(
+          self.id, ''.join(f'\n\t {commit}' for commit in commits)))
+
+  def _get_source(self, diff):
+    if diff.source is not None:
+      return diff.source
+    base, head = self._get_diff_range()[:2]
+    return self.diff_service, base, head, diff.path
+
+  def _is_content_scannable(self, diff):
+    if GITLINK_MODE in (diff.old_mode, diff.new_mode):
+      return False
+    service, _, _, path = self._get_source(diff)
+    if service.is_lfs_object(diff, path):
+      LOG.info('[{}] {} is stored in git LFS, content not scanned'.format(
+          self.id, diff.path))
+      return False
+    return True
+
+  def _load_lfs_attributes(self, diffs):
+    sources = {}
+    for diff in diffs:
+      service, _, _, path = self._get_source(diff)
+      sources.setdefault(service, []).append(path)
+    for service, paths in sources.items():
+      service.get_lfs_paths(paths)
+
+  def _is_oversized(self, diff, max_size):
+    service = self._get_source(diff)[0]
+    return any(oid is not None and service.get_object_size(oid) > max_size
+               for oid in (diff.old_oid, diff.new_oid))
+
+  def _has_content_diff(self, pattern, diffs,
+      max_size=DEFAULT_CONTENT_MAX_SIZE):
+    self._load_lfs_attributes(diffs)
+    sources = {}
+    oversized = []
+    for diff in diffs:
+      if not self._is_content_scannable(diff):
+        continue
+      service, base, head, path = self._get_source(diff)
+      if self._is_oversized(diff, max_size):
+        oversized.append((service, base, head, path))
+      else:
+        sources.setdefault((service, base, head), []).append(path)
+    for (service, base, head), paths in sources.items():
+      for line in service.iter_changed_lines(base, head, paths):
+        if re.match(pattern, line):
+          return True
+    for service, base, head, path in oversized:
+      regex = to_pickaxe_regex(pattern)
+      if regex is None:
+        LOG.warning('[{}] {} is larger than {} bytes, treating it as '
+                    'changed'.format(self.id, path, max_size))
+        return True
+      LOG.info('[{}] {} is larger than {} bytes, searching it with git '
+               'pickaxe'.format(self.id, path, max_size))
+      if service.has_pickaxe_match(base, head, regex, [path]):
+        return True
+    return False
+
+  def _has_key_diff(self, keys, diff, max_size):
+    if not self._is_content_scannable(diff):
+      return False
+    if self._is_oversized(diff, max_size):
+      LOG.warning('[{}] {} is larger than {} bytes, treating it as '
+                  'changed'.format(self.id, diff.path, max_size))
+      return True
+    service = self._get_source(diff)[0]
+    old = service.get_document(diff.old_oid, diff.path)
+    new = service.get_document(diff.new_oid, diff.path)
+    if INVALID in (old, new):
+      LOG.warning('[{}] {} could not be parsed, treating it as changed'.format(
+          self.id, diff.path))
+      return True
+    for key in keys:
+      if get_key_path(old, str(key)) != get_key_path(new, str(key)):
+        LOG.info('[{}] key {} changed in {}'.format(self.id, key, diff.path))
         return True
     return False
 
-  def _has_diff_expression(self):
-    diffs = self._get_diffs_from_current()
-    exp_dict = {}
+  def _has_pickaxe_diff(self, regex, diffs):
+    LOG.info('[{}] searching content changes with git pickaxe {}'.format(
+        self.id, regex))
+    self._load_lfs_attributes(diffs)
+    sources = {}
+    for diff in diffs:
+      if self._is_content_scannable(diff):
+        service, base, head, path = self._get_source(diff)
+        sources.setdefault((service, base, head), []).append(path)
+    return any(service.has_pickaxe_match(base, head, regex, paths) for
+               (service, base, head), paths in sources.items())
+
+  def _matching_paths(self, matches, path):
+    pattern_id = self.diff_service.matcher.register(path)
+    matched, masks = matches
+    if matched >> pattern_id & 1:
+      for detected_path, mask in masks.items():
+        if mask >> pattern_id & 1:
+          LOG.info('[{}] path pattern {} matches {}'.format(self.id, path,
+                                                            detected_path))
+          yield detected_path
+
+  def _get_rule(self, target_diff):
+    if self.submodules:
+      return dict(target_diff, **{SUBMODULES: True})
+    return target_diff
+
+  def _get_rule_cost(self, target_diff, diff_range):
+    base, head = diff_range[:2]
+    if self.diff_service.has_rule_result(base, head,
+                                         self._get_rule(target_diff)):
+      return COST_CACHED
+    if CONTENT in target_diff or KEYS in target_diff:
+      return COST_CONTENT
+    return COST_PATH
+
+  def _has_rule_diff(self, target_diff, diff_range):
+    if get_or_default(target_diff, PATH, None, str) is None:
+      return False
+    base, head = diff_range[:2]
+    return self.diff_service.get_rule_result(
+        base, head, self._get_rule(target_diff),
+        lambda: self._evaluate_rule(target_diff, diff_range))
+
+  def _evaluate_rule(self, target_diff, diff_range):
+    path = target_diff[PATH]
+    diffs = self.diff_service.get_changes(*diff_range)
+    matches = self.diff_service.get_path_matches(*diff_range)
+    content = get_or_default(target_diff, CONTENT, None, str)
+    max_size = get_or_default(target_diff, MAX_SIZE, DEFAULT_CONTENT_MAX_SIZE,
+                              int)
+    keys = get_or_default(target_diff, KEYS, None, list)
+    if keys is not None:
+      detected_paths = list(self._matching_paths(matches, path))
+      self._load_lfs_attributes(
+          [diffs[detected_path] for detected_path in detected_paths])
+      for detected_path in detected_paths:
+        if self._has_key_diff(keys, diffs[detected_path], max_size):
+          return True
+      return False
+    if content is not None and get_or_default(target_diff, PICKAXE, False,
+                                              bool):
+      regex = to_pickaxe_regex(content)
+      if regex is not None:
+        detected_diffs = [diffs[detected_path] for detected_path in
+                          self._matching_paths(matches, path)]
+        return self._has_pickaxe_diff(regex, detected_diffs)
+      LOG.info('[{}] content pattern {} not supported by git pickaxe'.format(
+          self.id, content))
+    if content is not None:
+      detected_diffs = [diffs[detected_path] for detected_path in
+                        self._matching_paths(matches, path)]
+      return self._has_content_diff(content, detected_diffs, max_size)
+    for detected_path in self._matching_paths(matches, path):
+      service, _, _, source_path = self._get_source(diffs[detected_path])
+      if not service.is_lfs_unchanged(diffs[detected_path], source_path):
+        return True
+      LOG.info('[{}] LFS object of {} is unchanged'.format(self.id,
+                                                            detected_path))
+    return False
+
+  def _has_diff_expression(self, diff_range):
+    resolvers = {}
+    costs = {}
     for target_diff in self.target_diffs:
       if type(target_diff) is not dict:
         raise ConfigError('Invalid diff configuration specified:\n{}'.format(
@@ -124,47 +450,224 @@ class LocalDiffConditional(Conditional):
       if id is not None:
         path = get_or_default(target_diff, PATH, None, str)
         if path is not None:
-          for detected_diff in diffs:
-            if re.match(target_diff[PATH],
-                        detected_diff.a_rawpath.decode(UTF8)):
-              LOG.info('[{}] path pattern {} matches {}'.format(self.id,
-                                                                target_diff[
-                                                                  PATH],
-                                                                detected_diff.a_rawpath.decode(
-                                                                    UTF8)))
-              content = get_or_default(target_diff, CONTENT, None, str)
-              if content is not None:
-                if id not in exp_dict or not exp_dict[id]:
-                  exp_dict[id] = self._has_content_diff(content, detected_diff)
-              else:
-                exp_dict[id] = True
-          if id not in exp_dict:
-            exp_dict[id] = False
-    return evaluate_expression(self.expression, exp_dict)
-
-  def _has_diff_all(self):
-    diffs = self._get_diffs_from_current()
+          resolvers[id] = functools.partial(self._has_rule_diff, target_diff,
+                                            diff_range)
+          costs[id] = self._get_rule_cost(target_diff, diff_range)
+    return self.compiled_expression.evaluate_lazy(resolvers, costs)
+
+  def _has_diff_all(self, diff_range):
     for target_diff in self.target_diffs:
       if type(target_diff) is not dict:
         raise ConfigError(
             'Invalid diff configuration specified:\n{}'.format(
                 yaml.dump(target_diff)))
-      for detected_diff in diffs:
-        path = get_or_default(target_diff, PATH, None, str)
-        if path is not None:
-          if re.match(path, detected_diff.a_rawpath.decode(UTF8)):
-            LOG.info('[{}] path pattern {} matches {}'.format(self.id, path,
-                                                              detected_diff.a_rawpath.decode(
-                                                                  UTF8)))
-            content = get_or_default(target_diff, CONTENT, None, str)
-            if content is not None:
-              if self._has_content_diff(content, detected_diff):
-                return True
-            else:
-              return True
+    for target_diff in sorted(
+        self.target_diffs, key=lambda target_diff: self._get_rule_cost(
+            target_diff, diff_range)):
+      if self._has_rule_diff(target_diff, diff_range):
+        return True
     return False
 
 
+def _get_path_rules(config, condition_type, required=True):
+  target_diffs = get_or_default(config, DIFF, None, list)
+  if target_diffs is None:
+    if not required:
+      return []
+    raise ConfigError(
+        'No diffs specified in the {} condition:\n{}'.format(
+            condition_type, yaml.dump(config)))
+  for target_diff in target_diffs:
+    if type(target_diff) is not dict or get_or_default(target_diff, PATH,
+                                                       None, str) is None:
+      raise ConfigError('Invalid diff configuration specified:\n{}'.format(
+          yaml.dump(target_diff)))
+    for field in (CONTENT, KEYS, PICKAXE, MAX_SIZE):
+      if field in target_diff:
+        raise ConfigError(
+            'Content rules ({}) are not supported by {} conditions:\n{}'.format(
+                field, condition_type, yaml.dump(target_diff)))
+  return target_diffs
+
+
+def _has_path_rule_match(matcher, paths, target_diffs, expression):
+  matched = matcher.match_paths(paths)[0]
+  results = {}
+  for target_diff in target_diffs:
+    result = matched >> matcher.register(target_diff[PATH]) & 1 == 1
+    if expression is None and result:
+      return True
+    if ID in target_diff:
+      results[target_diff[ID]] = result
+  if expression is None:
+    return False
+  return expression.evaluate(results)
+
+
+class WorktreeConditional(Conditional):
+
+  def __init__(self):
+    self.id = None
+    self.target_diffs = None
+    self.active_branch = None
+    self.expression = None
+    self.compiled_expression = None
+    self.diff_service = None
+    self.pathspecs = None
+    self.result = None
+
+  def configure(self, config, checkpoint, diff_service=None):
+    self.id = get_or_default(config, ID, None, str)
+    if self.id is None:
+      raise ConfigError('id not specified:\n{}'.format(yaml.dump(config)))
+    self.target_diffs = _get_path_rules(config, WORKTREE)
+    branches = get_or_default(config, BRANCH, None, dict)
+    if branches is not None:
+      self.active_branch = get_or_default(branches, ACTIVE, None, str)
+    self.expression = get_or_default(config, EXPRESSION, None, str)
+    if self.expression is not None:
+      self.compiled_expression = compile_expression(self.expression)
+    if diff_service is None:
+      diff_service = DiffService()
+    self.diff_service = diff_service
+    for target_diff in self.target_diffs:
+      self.diff_service.matcher.register(target_diff[PATH])
+    self.pathspecs = to_pathspecs(
+        [target_diff[PATH] for target_diff in self.target_diffs])
+
+  def evaluate(self):
+    if self.result is None:
+      if self.active_branch is not None and \
+          self.diff_service.get_active_branch() != self.active_branch:
+        LOG.info(
+            '[{}] Not on active branch, conditional disabled'.format(self.id))
+        self.result = False
+        return self.result
+      changes = self.diff_service.get_worktree_changes(self.pathspecs)
+      if LOG.isEnabledFor(logging.INFO):
+        LOG.info('[{}] uncommitted changes:\n{}\n'.format(self.id, ''.join(
+            f'\n\t {path}' for path in changes)))
+      self.result = _has_path_rule_match(self.diff_service.matcher, changes,
+                                         self.target_diffs,
+                                         self.compiled_expression)
+    return self.result
+
+  def get_cost(self):
+    if self.result is not None:
+      return COST_CACHED
+    return COST_SCAN
+
+  def create_checkpoint(self):
+    return {}
+
+
+class FileHashConditional(Conditional):
+
+  def __init__(self):
+    self.id = None
+    self.root = None
+    self.target_diffs = None
+    self.expression = None
+    self.compiled_expression = None
+    self.workers = None
+    self.checkpoint = None
+    self.matcher = None
+    self.manifest = None
+    self.scanned = None
+    self.result = None
+
+  def configure(self, config, checkpoint, diff_service=None):
+    self.id = get_or_default(config, ID, None, str)
+    if self.id is None:
+      raise ConfigError('id not specified:\n{}'.format(yaml.dump(config)))
+    self.root = get_or_default(config, PATH, None, str)
+    if self.root is None:
+      raise ConfigError(
+          'No path specified in the filehash condition:\n{}'.format(
+              yaml.dump(config)))
+    self.target_diffs = _get_path_rules(config, FILEHASH, required=False)
+    self.expression = get_or_default(config, EXPRESSION, None, str)
+    if self.expression is not None:
+      self.compiled_expression = compile_expression(self.expression)
+    self.workers = get_or_default(config, WORKERS, None, int)
+    self.checkpoint = checkpoint
+    self.matcher = PathMatcher()
+    for target_diff in self.target_diffs:
+      self.matcher.register(target_diff[PATH])
+
+  def evaluate(self):
+    if self.result is None:
+      previous = get_or_default(self.checkpoint, FILES, None, dict)
+      self._scan()
+      if previous is None:
+        LOG.warning('[{}] no checkpoint found, pipe will be executed'.format(
+            self.id))
+        self.result = True
+        return self.result
+      changed = diff_manifests(previous, self.manifest)
+      if LOG.isEnabledFor(logging.INFO):
+        LOG.info('[{}] changed files in {}:\n{}\n'.format(
+            self.id, self.root, ''.join(f'\n\t {path}' for path in changed)))
+      if len(self.target_diffs) == 0:
+        self.result = len(changed) > 0
+      else:
+        self.result = _has_path_rule_match(self.matcher, changed,
+                                           self.target_diffs,
+                                           self.compiled_expression)
+    return self.result
+
+  def get_cost(self):
+    if self.result is not None:
+      return COST_CACHED
+    return COST_SCAN
+
+  def create_checkpoint(self):
+    if self.manifest is None:
+      self._scan()
+    LOG.info('[{}] New checkpoint of {} files'.format(self.id,
+                                                      len(self.manifest)))
+    return {FILES: dict(self.manifest), SCANNED: self.scanned}
+
+  def _scan(self):
+    if not os.path.isdir(self.root):
+      LOG.warning('[{}] directory {} not found'.format(self.id, self.root))
+    self.manifest, self.scanned = build_manifest(
+        self.root, get_or_default(self.checkpoint, FILES, None, dict),
+        get_or_default(self.checkpoint, SCANNED, None, int), self.workers)
+
+
+class SharedConditional(Conditional):
+
+  def __init__(self, conditional):
+    self.id = None
+    self.conditional = conditional
+
+  def configure(self, config, checkpoint, diff_service=None):
+    self.id = get_or_default(config, ID, None, str)
+
+  def evaluate(self):
+    LOG.debug('[{}] sharing the evaluation of condition {}'.format(
+        self.id, self.conditional.id))
+    return self._delegate(self.conditional.evaluate)
+
+  def get_cost(self):
+    return self.conditional.get_cost()
+
+  def prepare(self):
+    return self._delegate(self.conditional.prepare)
+
+  def create_checkpoint(self):
+    return self._delegate(self.conditional.create_checkpoint)
+
+  def _delegate(self, method):
+    shared_id = self.conditional.id
+    self.conditional.id = self.id
+    try:
+      return method()
+    finally:
+      self.conditional.id = shared_id
+
+
 class Executor:
 
   def __init__(self):
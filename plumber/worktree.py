@@ -0,0 +1,98 @@
+import hashlib
+import os
+import stat
+import subprocess
+import time
+
+from plumber.common import LOG, UTF8
+from plumber.matchers import is_under_prefix
+
+RACY_WINDOW_NS = 2 * 10 ** 9
+GITLINK_TYPE = 'commit'
+
+
+def blob_oid(data):
+  return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def _pathspec_args(pathspecs):
+  if pathspecs is None:
+    return []
+  return ['--'] + [':(top,literal){}'.format(pathspec) for pathspec in
+                   pathspecs]
+
+
+def list_worktree_files(repo, pathspecs=None):
+  output = repo.git.ls_files('-z', '--cached', '--others', '--exclude-standard',
+                             *_pathspec_args(pathspecs))
+  return sorted(set(path for path in output.split('\0') if path))
+
+
+def list_tree_blobs(repo, rev, pathspecs=None):
+  blobs = {}
+  output = repo.git.ls_tree('-r', '-z', '--full-tree', rev,
+                            *_pathspec_args(pathspecs))
+  for entry in output.split('\0'):
+    if not entry:
+      continue
+    meta, path = entry.split('\t', 1)
+    _, object_type, oid = meta.split(' ')
+    if object_type != GITLINK_TYPE:
+      blobs[path] = oid
+  return blobs
+
+
+def hash_paths(repo, paths):
+  if len(paths) == 0:
+    return []
+  process = repo.git.hash_object('--stdin-paths', as_process=True,
+                                 istream=subprocess.PIPE)
+  output, _ = process.proc.communicate(
+      ''.join('{}\n'.format(path) for path in paths).encode(UTF8))
+  return output.decode(UTF8).split()
+
+
+class WorktreeScanner:
+
+  def __init__(self, repo, stat_cache):
+    self.repo = repo
+    self.stat_cache = stat_cache
+
+  def get_oids(self, paths, pathspecs=None):
+    root = self.repo.working_tree_dir
+    scan_start = time.time_ns()
+    stats = self.stat_cache.get_stats()
+    oids = {}
+    updates = []
+    missing = []
+    for path in paths:
+      try:
+        path_stat = os.lstat(os.path.join(root, path))
+      except OSError:
+        continue
+      if stat.S_ISDIR(path_stat.st_mode):
+        continue
+      key = (path_stat.st_mtime_ns, path_stat.st_size, path_stat.st_ino)
+      cached = stats.get(path)
+      if cached is not None and cached[:3] == key:
+        oids[path] = cached[3]
+      elif stat.S_ISLNK(path_stat.st_mode):
+        oids[path] = blob_oid(os.readlink(os.path.join(root, path)).encode(
+            UTF8))
+        updates.append((path,) + key + (oids[path],))
+      elif '\n' in path:
+        oids[path] = None
+      else:
+        missing.append((path, key))
+    LOG.debug('Hashing {} of {} worktree files'.format(len(missing),
+                                                       len(paths)))
+    for (path, key), oid in zip(missing,
+                                hash_paths(self.repo,
+                                           [path for path, _ in missing])):
+      oids[path] = oid
+      if key[0] < scan_start - RACY_WINDOW_NS:
+        updates.append((path,) + key + (oid,))
+    self.stat_cache.save_stats(updates, [
+      path for path in stats if path not in oids and (pathspecs is None or any(
+          is_under_prefix(path, pathspec) for pathspec in pathspecs))])
+    return oids
@@ -0,0 +1,30 @@
+from plumber.bloom import BloomFilter, path_entries, MAX_CHANGED_PATHS
+
+
+def test_path_entries():
+  assert path_entries('a/b/c') == ['a/b/c', 'a/b', 'a']
+  assert path_entries('file') == ['file']
+
+
+def test_bloom_filter():
+  bloom = BloomFilter.from_paths(['services/billing/file1', 'README.md'])
+  assert bloom.might_contain('services/billing/file1')
+  assert bloom.might_contain('services/billing')
+  assert bloom.might_contain('services')
+  assert bloom.might_contain('README.md')
+  misses = [path for path in ['other/{}'.format(i) for i in range(100)] if
+            bloom.might_contain(path)]
+  assert len(misses) < 10
+  assert BloomFilter(bloom.to_bytes()).might_contain('services/billing/file1')
+
+
+def test_bloom_filter_empty():
+  assert not BloomFilter.from_paths([]).might_contain('file')
+
+
+def test_bloom_filter_saturated():
+  bloom = BloomFilter.from_paths(
+      ['file{}'.format(i) for i in range(MAX_CHANGED_PATHS + 1)])
+  assert bloom.is_saturated()
+  assert bloom.to_bytes() == b''
+  assert BloomFilter(b'').might_contain('anything')
@@ -0,0 +1,72 @@
+import os
+
+from plumber.cache import DiffCache
+
+
+def test_diff_cache_changes(tmp_path):
+  path = os.path.join(str(tmp_path), 'plumber', 'cache.sqlite')
+  cache = DiffCache(path, 1024 * 1024)
+  assert cache.get_changes('base', 'head', None) is None
+  changes = [['mypath/file1', 'a' * 40, 'b' * 40, '100644', '100644']]
+  cache.save_changes('base', 'head', None, changes)
+  assert cache.get_changes('base', 'head', None) == changes
+  assert cache.get_changes('base', 'head', ('mypath',)) is None
+  cache.close()
+  assert DiffCache(path, 1024 * 1024).get_changes('base', 'head',
+                                                  None) == changes
+
+
+def test_diff_cache_matches(tmp_path):
+  cache = DiffCache(os.path.join(str(tmp_path), 'cache.sqlite'), 1024 * 1024)
+  pattern = {'path': 'mypath/.*', 'content': 'name:.*'}
+  assert cache.get_match('base', 'head', pattern) is None
+  cache.save_match('base', 'head', pattern, True)
+  cache.save_match('base', 'head', {'path': 'mypath/.*'}, False)
+  assert cache.get_match('base', 'head', pattern) is True
+  assert cache.get_match('base', 'head', {'path': 'mypath/.*'}) is False
+  assert cache.get_match('other', 'head', pattern) is None
+
+
+def test_diff_cache_evict(tmp_path):
+  cache = DiffCache(os.path.join(str(tmp_path), 'cache.sqlite'), 300)
+  for i in range(10):
+    cache.save_match('base', 'head-{}'.format(i), {'path': '.*'}, True)
+  assert cache.get_size() == 10 * 128
+  cache.close()
+  assert cache.get_size() <= 300
+  assert cache.get_match('base', 'head-9', {'path': '.*'}) is True
+  assert cache.get_match('base', 'head-0', {'path': '.*'}) is None
+
+
+def test_diff_cache_unwritable(tmp_path):
+  path = os.path.join(str(tmp_path), 'file')
+  with open(path, 'w') as file:
+    file.write('not a directory')
+  cache = DiffCache(os.path.join(path, 'cache.sqlite'), 1024)
+  cache.save_match('base', 'head', {'path': '.*'}, True)
+  cache.close()
+  assert cache.get_match('base', 'head', {'path': '.*'}) is None
+
+
+def test_diff_cache_blooms(tmp_path):
+  cache = DiffCache(os.path.join(str(tmp_path), 'cache.sqlite'), 1024 * 1024)
+  assert cache.get_bloom('commit') is None
+  cache.save_bloom('commit', b'\x01\x02')
+  cache.save_bloom('saturated', b'')
+  assert cache.get_bloom('commit') == b'\x01\x02'
+  assert cache.get_bloom('saturated') == b''
+
+
+def test_diff_cache_batched_writes(tmp_path):
+  path = os.path.join(str(tmp_path), 'cache.sqlite')
+  cache = DiffCache(path, 1024 * 1024)
+  reader = DiffCache(path, 1024 * 1024)
+  cache.save_match('base', 'head', {'path': '.*'}, True)
+  assert cache.get_match('base', 'head', {'path': '.*'}) is True
+  assert reader.get_match('base', 'head', {'path': '.*'}) is None
+  cache.flush()
+  assert reader.get_match('base', 'head', {'path': '.*'}) is True
+  cache.save_match('base', 'head', {'path': '.*'}, False)
+  cache.close()
+  reader.close()
+  assert DiffCache(path, 1024 * 1024).get_size() == 128
@@ -5,7 +5,7 @@ from git import Repo
 
 from plumber.cli import cli
 from plumber.common import PIPES, ID, CONDITIONS, TYPE, LOCALDIFF, DIFF, PATH, \
-  ConfigError, ACTIONS, STEPS
+  ConfigError, ACTIONS, STEPS, TAGS, EXPRESSION
 
 
 def get_next_commit():
@@ -44,7 +44,9 @@ def test_init(checkpoint_mock, yml_save_mock, env_get_mock):
   yml_save_mock.return_value = None
   checkpoint_mock.return_value = {'commit': 'checkpoint'}
   runner = CliRunner()
-  result = runner.invoke(cli, ['init'])
+  with mock.patch('plumber.diffs.DiffService.close') as close_mock:
+    result = runner.invoke(cli, ['init'])
+  close_mock.assert_called_once()
   assert result.exit_code == 0
   env_get_mock.assert_called_once()
   yml_save_mock.assert_called_once()
@@ -176,3 +178,176 @@ def test_execute_error(env_get_mock):
   runner = CliRunner()
   result = runner.invoke(cli, ['go'])
   assert result.exit_code != 0
+
+
+@mock.patch('plumber.io.YamlEnvFileStore.get_data')
+@mock.patch('plumber.operators.LocalDiffConditional.prepare')
+@mock.patch('plumber.operators.LocalDiffConditional.evaluate')
+@mock.patch('plumber.diffs.DiffService.write_commit_graph')
+def test_prepare(graph_mock, evaluate_mock, prepare_mock, env_get_mock):
+  CONFIG = {
+    PIPES: [
+      {
+        ID: 'mypipe',
+        CONDITIONS: [
+          {
+            ID: 'diff',
+            TYPE: LOCALDIFF,
+            DIFF: [
+              {
+                PATH: '.*'
+              }
+            ]
+          }
+        ]
+      }
+    ]
+  }
+  env_get_mock.return_value = CONFIG
+  evaluate_mock.return_value = True
+  prepare_mock.return_value = True
+  runner = CliRunner()
+  with mock.patch('plumber.diffs.DiffService.close') as close_mock:
+    result = runner.invoke(cli, ['prepare'])
+  close_mock.assert_called_once()
+  assert result.exit_code == 0
+  assert 'mypipe' in result.output
+  assert 'True' in result.output
+  graph_mock.assert_called_once()
+  prepare_mock.assert_called_once()
+  evaluate_mock.assert_called_once()
+
+
+@mock.patch('plumber.io.YamlEnvFileStore.get_data')
+def test_prepare_no_config(env_get_mock):
+  env_get_mock.return_value = {}
+  runner = CliRunner()
+  result = runner.invoke(cli, ['prepare'])
+  assert result.exit_code != 0
+
+
+def get_selection_config():
+  return {
+    PIPES: [
+      {
+        ID: pipe_id,
+        TAGS: tags,
+        CONDITIONS: [
+          {
+            ID: 'diff',
+            TYPE: LOCALDIFF,
+            DIFF: [
+              {
+                PATH: '{}/.*'.format(pipe_id)
+              }
+            ]
+          }
+        ],
+        ACTIONS: {
+          STEPS: [
+            'echo "Executing CD"'
+          ]
+        }
+      } for pipe_id, tags in
+      [('backend', ['services']), ('frontend', ['web']),
+       ('worker', ['services'])]
+    ]
+  }
+
+
+@mock.patch('plumber.io.YamlEnvFileStore.get_data')
+@mock.patch('plumber.operators.LocalDiffConditional.evaluate')
+def test_status_selection(evaluate_mock, env_get_mock):
+  env_get_mock.return_value = get_selection_config()
+  evaluate_mock.return_value = True
+  runner = CliRunner()
+  result = runner.invoke(cli, ['status', '--tag', 'services', '--exclude',
+                               'worker', '--pipe', 'frontend'])
+  assert result.exit_code == 0
+  assert 'backend' in result.output
+  assert 'frontend' in result.output
+  assert 'worker' not in result.output
+  assert evaluate_mock.call_count == 2
+
+
+@mock.patch('plumber.io.YamlEnvFileStore.get_data')
+def test_status_selection_unknown_pipe(env_get_mock):
+  env_get_mock.return_value = get_selection_config()
+  runner = CliRunner()
+  result = runner.invoke(cli, ['status', '--pipe', 'missing'])
+  assert result.exit_code != 0
+
+
+@mock.patch('plumber.io.YamlEnvFileStore.get_data')
+@mock.patch('plumber.io.YamlFileStore.get_data')
+@mock.patch('plumber.io.YamlFileStore.save_data')
+@mock.patch('plumber.operators.LocalDiffConditional.create_checkpoint')
+def test_init_selection(checkpoint_mock, yml_save_mock, yml_get_mock,
+    env_get_mock):
+  env_get_mock.return_value = get_selection_config()
+  yml_get_mock.return_value = {'frontend': {'diff': {'commit': 'old'}}}
+  yml_save_mock.return_value = None
+  checkpoint_mock.return_value = {'commit': 'checkpoint'}
+  runner = CliRunner()
+  result = runner.invoke(cli, ['init', '--tag', 'services'])
+  assert result.exit_code == 0
+  args = yml_save_mock.call_args[0][0]
+  assert args['backend']['diff']['commit'] == 'checkpoint'
+  assert args['worker']['diff']['commit'] == 'checkpoint'
+  assert args['frontend']['diff']['commit'] == 'old'
+  result = runner.invoke(cli, ['init', '--pipe', 'frontend'])
+  assert result.exit_code != 0
+
+
+@mock.patch('plumber.io.YamlEnvFileStore.get_data')
+@mock.patch('plumber.io.YamlFileStore.get_data')
+@mock.patch('plumber.io.YamlFileStore.save_data')
+@mock.patch('plumber.operators.LocalDiffConditional.evaluate')
+@mock.patch('plumber.operators.LocalDiffConditional.create_checkpoint')
+def test_execute_selection(checkpoint_mock, evaluate_mock, yml_save_mock,
+    yml_get_mock, env_get_mock):
+  env_get_mock.return_value = get_selection_config()
+  yml_get_mock.return_value = {'frontend': {'diff': {'commit': 'old'}}}
+  evaluate_mock.return_value = True
+  yml_save_mock.return_value = None
+  checkpoint_mock.return_value = {'commit': 'checkpoint'}
+  runner = CliRunner()
+  result = runner.invoke(cli, ['go', '--pipe', 'backend'])
+  assert result.exit_code == 0
+  assert 'frontend' not in result.output
+  evaluate_mock.assert_called_once()
+  args = yml_save_mock.call_args[0][0]
+  assert args['backend']['diff']['commit'] == 'checkpoint'
+  assert args['frontend']['diff']['commit'] == 'old'
+  assert 'worker' not in args
+
+
+@mock.patch('plumber.io.YamlEnvFileStore.get_data')
+@mock.patch('plumber.io.YamlFileStore.save_data')
+@mock.patch('plumber.operators.LocalDiffConditional.evaluate')
+def test_execute_invalid_later_pipe(evaluate_mock, yml_save_mock,
+    env_get_mock, tmp_path):
+  marker = tmp_path / 'executed'
+  config = get_selection_config()
+  config[PIPES][0][ACTIONS][STEPS] = ['touch {}'.format(marker)]
+  config[PIPES][1][CONDITIONS][0][TYPE] = 'bogus'
+  env_get_mock.return_value = config
+  evaluate_mock.return_value = True
+  runner = CliRunner()
+  result = runner.invoke(cli, ['go'])
+  assert result.exit_code != 0
+  assert not marker.exists()
+  evaluate_mock.assert_not_called()
+  yml_save_mock.assert_not_called()
+
+
+@mock.patch('plumber.io.YamlEnvFileStore.get_data')
+@mock.patch('plumber.operators.LocalDiffConditional.evaluate')
+def test_status_invalid_condition_expression(evaluate_mock, env_get_mock):
+  config = get_selection_config()
+  config[PIPES][1][CONDITIONS][0][EXPRESSION] = 'd and ('
+  env_get_mock.return_value = config
+  runner = CliRunner()
+  result = runner.invoke(cli, ['status'])
+  assert result.exit_code != 0
+  evaluate_mock.assert_not_called()
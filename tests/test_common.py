@@ -47,6 +47,94 @@ def test_evaluate_expression_invalid():
     assert type(e) is NameError
 
 
+def test_evaluate_expression_not_and_parentheses():
+  values = {'a': True, 'b': False, 'c': False}
+  from plumber.common import evaluate_expression
+  assert evaluate_expression('not b', values) is True
+  assert evaluate_expression('a and not (b or c)', values) is True
+  assert evaluate_expression('(a and b) or c', values) is False
+
+
+def test_compile_expression_memoized():
+  from plumber.common import compile_expression
+  compiled = compile_expression('a and b')
+  assert compile_expression('a and b') is compiled
+  assert compiled.names == {'a', 'b'}
+
+
+@pytest.mark.parametrize('expression', [
+  '__import__("os").system("true")',
+  'a.b',
+  'a == b',
+  'a[0]',
+  'f(a)',
+  'lambda: a',
+  '-a',
+  'a and',
+])
+def test_compile_expression_unsupported(expression):
+  from plumber.common import compile_expression
+  with pytest.raises(ConfigError):
+    compile_expression(expression)
+
+
+def test_evaluate_lazy_short_circuit():
+  from plumber.common import compile_expression
+  calls = []
+
+  def resolver(name, value):
+    def resolve():
+      calls.append(name)
+      return value
+
+    return resolve
+
+  resolvers = {'a': resolver('a', True), 'b': resolver('b', False)}
+  assert compile_expression('a or b').evaluate_lazy(resolvers) is True
+  assert calls == ['a']
+
+
+def test_evaluate_lazy_cost_order():
+  from plumber.common import compile_expression
+  calls = []
+
+  def resolver(name, value):
+    def resolve():
+      calls.append(name)
+      return value
+
+    return resolve
+
+  resolvers = {'a': resolver('a', True), 'b': resolver('b', False),
+               'c': resolver('c', True)}
+  expression = compile_expression('(a or c) and b')
+  assert expression.evaluate_lazy(resolvers, {'a': 2, 'b': 1, 'c': 1}) is False
+  assert calls == ['b']
+  calls.clear()
+  assert compile_expression('a or c').evaluate_lazy(
+      resolvers, {'a': 2, 'c': 1}) is True
+  assert calls == ['c']
+
+
+def test_evaluate_lazy_resolves_once():
+  from plumber.common import compile_expression
+  calls = []
+
+  def resolve():
+    calls.append('a')
+    return False
+
+  assert compile_expression('(a or a) or not a').evaluate_lazy(
+      {'a': resolve}) is True
+  assert calls == ['a']
+
+
+def test_evaluate_lazy_undefined_name():
+  from plumber.common import compile_expression
+  with pytest.raises(NameError):
+    compile_expression('a and b').evaluate_lazy({'a': lambda: False})
+
+
 def test_create_execution_report():
   results = [{ID: 'job', STATUS: EXECUTED}]
   from plumber.common import create_execution_report
@@ -1,4 +1,9 @@
+import hashlib
+import os
+import subprocess
+
 import pytest
+from git import GitCommandError
 from mock import MagicMock
 
 from plumber.common import ID, DIFF, BRANCH, ACTIVE, TARGET, EXPRESSION, \
@@ -6,33 +11,108 @@ from plumber.common import ID, DIFF, BRANCH, ACTIVE, TARGET, EXPRESSION, \
   STEP, UTF8, ExecutionFailure, PREHOOK, POSTHOOK, CONDITION, SUCCESS, FAILURE, \
   CONDITIONS, ACTIONS, TYPE, LOCALDIFF, GLOBAL, CHECKPOINTING, PIPE, UNIT, \
   CONFIG, PIPES, SINGLE, LOCALGIT, DETECTED, STATUS, EXECUTED, \
-  FAILED, NOT_DETECTED, CONTENT
+  FAILED, NOT_DETECTED, CONTENT, MAX_SIZE, PICKAXE, TREE, PREFIXES, SUBMODULES, WORKTREE, FILEHASH, FILES, \
+  WORKERS, KEYS, DEPTH
 ################################################
 # Helpers
 ################################################
-from plumber.core import LocalDiffConditional
+from plumber.core import LocalDiffConditional, WorktreeConditional, \
+  FileHashConditional
+from plumber.diffs import DiffService
 from plumber.io import YamlFileStore, YamlGitFileStore
 
 
+BLOBS = {
+  'a' * 40: b'name: whatever',
+  'b' * 40: b''
+}
+
+
+class CatFileMock:
+
+  def __init__(self, batch):
+    self.batch = batch
+    self.buffer = b''
+    self.stdin = MagicMock()
+    self.stdin.write.side_effect = self.request
+    self.stdout = self
+
+  def request(self, data):
+    name = data.decode(UTF8).strip()
+    if name in BLOBS:
+      oid, object_type, content = name, 'blob', BLOBS[name]
+    elif ':' in name:
+      oid, object_type, content = hashlib.sha1(
+          name.encode(UTF8)).hexdigest(), 'tree', b''
+    else:
+      self.buffer += '{} missing\n'.format(name).encode(UTF8)
+      return
+    self.buffer += '{} {} {}\n'.format(oid, object_type, len(content)).encode(
+        UTF8)
+    if self.batch:
+      self.buffer += content + b'\n'
+
+  def readline(self):
+    line, self.buffer = self.buffer.split(b'\n', 1)
+    return line + b'\n'
+
+  def read(self, size):
+    data, self.buffer = self.buffer[:size], self.buffer[size:]
+    return data
+
+
 def get_repo_mock():
   repo_mock = MagicMock()
   repo_mock.active_branch = 'master'
   repo_mock.git.checkout.return_value = None
-  commits = []
-  for commit_id in ['commit-1', 'last-checkpoint']:
-    commit_mock = MagicMock()
-    commit_mock.__str__.return_value = commit_id
-    commits.append(commit_mock)
-  repo_mock.iter_commits.return_value = commits
+  repo_mock.git.rev_parse.side_effect = lambda *args: args[-1].split('^')[0]
+  repo_mock.git.cat_file.side_effect = lambda *args, **kwargs: CatFileMock(
+      args[0] == '--batch')
+  repo_mock.head.commit.__str__.return_value = 'commit-1'
   diffs = []
   for path in ['path1/file1', 'mypath/file1']:
-    diff_mock = MagicMock()
-    diff_mock.a_rawpath.decode.return_value = path
-    diff_mock.a_blob.data_stream.read.return_value = b'name: whatever'
-    diff_mock.b_blob.data_stream.read.return_value = b''
-    diffs.append(diff_mock)
-  repo_mock.head.commit.diff.return_value = diffs
-  return repo_mock, commits, diffs
+    diffs.append(
+        ':100644 100644 {} {} M\0{}\0'.format('b' * 40, 'a' * 40, path))
+  repo_mock.git.diff_tree.return_value = ''.join(diffs)
+  repo_mock.git.diff.side_effect = lambda *args, **kwargs: MagicMock(
+      stdout=iter([b'@@ -0,0 +1 @@\n', b'+name: whatever\n']))
+  return repo_mock
+
+
+def git(cwd, *args):
+  return subprocess.run(['git'] + list(args), cwd=cwd, check=True,
+                        capture_output=True).stdout.decode(UTF8).strip()
+
+
+def create_test_repo(path):
+  git(path, 'init', '-q', '-b', 'master')
+  git(path, 'config', 'user.email', 'plumber@test')
+  git(path, 'config', 'user.name', 'plumber')
+  return path
+
+
+def commit_file(repo_path, path, content, message='change'):
+  file_path = os.path.join(repo_path, path)
+  os.makedirs(os.path.dirname(file_path), exist_ok=True)
+  with open(file_path, 'w') as file:
+    file.write(content)
+  git(repo_path, 'add', '-A')
+  git(repo_path, 'commit', '-q', '-m', message)
+  return git(repo_path, 'rev-parse', 'HEAD')
+
+
+def create_shallow_clone(path, commits):
+  origin_path = os.path.join(path, 'origin')
+  os.makedirs(origin_path)
+  create_test_repo(origin_path)
+  for file_path, content in commits:
+    commit_file(origin_path, file_path, content)
+  remote_path = os.path.join(path, 'remote.git')
+  git(path, 'clone', '-q', '--bare', origin_path, remote_path)
+  clone_path = os.path.join(path, 'clone')
+  git(path, 'clone', '-q', '--depth=1', 'file://{}'.format(remote_path),
+      clone_path)
+  return origin_path, clone_path
 
 
 ################################################
@@ -226,20 +306,14 @@ def test_local_diff_conditional_evaluate():
   CHECKPOINT = {COMMIT: 'last-checkpoint'}
   from plumber.operators import LocalDiffConditional
   conditional = LocalDiffConditional()
-  conditional.configure(config, CHECKPOINT)
-  conditional.repo, commits, diffs = get_repo_mock()
+  conditional.configure(config, CHECKPOINT, DiffService(get_repo_mock()))
 
   result = conditional.evaluate()
   assert result is True
-  conditional.repo.git.checkout.assert_called()
-  conditional.repo.git.checkout.assert_any_call('testing')
-  conditional.repo.git.checkout.assert_any_call('master')
-  for commit in commits:
-    commit.__str__.assert_called()
-  conditional.repo.iter_commits.assert_called_once()
-  for diff in diffs:
-    diff.a_rawpath.decode.assert_called()
-  conditional.repo.head.commit.diff.assert_called()
+  conditional.diff_service.repo.git.checkout.assert_not_called()
+  conditional.diff_service.repo.git.rev_parse.assert_any_call(
+      '--verify', '--quiet', 'testing^{commit}')
+  conditional.diff_service.repo.git.diff_tree.assert_called_once()
 
 
 def test_local_diff_conditional_evaluate_content():
@@ -258,20 +332,14 @@ def test_local_diff_conditional_evaluate_content():
   CHECKPOINT = {COMMIT: 'last-checkpoint'}
   from plumber.operators import LocalDiffConditional
   conditional = LocalDiffConditional()
-  conditional.configure(config, CHECKPOINT)
-  conditional.repo, commits, diffs = get_repo_mock()
+  conditional.configure(config, CHECKPOINT, DiffService(get_repo_mock()))
 
   result = conditional.evaluate()
   assert result is True
-  conditional.repo.git.checkout.assert_called()
-  conditional.repo.git.checkout.assert_any_call('testing')
-  conditional.repo.git.checkout.assert_any_call('master')
-  for commit in commits:
-    commit.__str__.assert_called()
-  conditional.repo.iter_commits.assert_called_once()
-  for diff in diffs:
-    diff.a_rawpath.decode.assert_called()
-  conditional.repo.head.commit.diff.assert_called()
+  conditional.diff_service.repo.git.checkout.assert_not_called()
+  conditional.diff_service.repo.git.rev_parse.assert_any_call(
+      '--verify', '--quiet', 'testing^{commit}')
+  conditional.diff_service.repo.git.diff_tree.assert_called_once()
 
 
 def test_local_diff_conditional_evaluate_not_active_branch():
@@ -289,9 +357,8 @@ def test_local_diff_conditional_evaluate_not_active_branch():
   CHECKPOINT = {COMMIT: 'last-checkpoint'}
   from plumber.operators import LocalDiffConditional
   conditional = LocalDiffConditional()
-  conditional.configure(config, CHECKPOINT)
-  conditional.repo = MagicMock()
-  conditional.repo.active_branch = 'master'
+  conditional.configure(config, CHECKPOINT, DiffService(MagicMock()))
+  conditional.diff_service.repo.active_branch = 'master'
 
   assert conditional.evaluate() is False
 
@@ -319,8 +386,7 @@ def test_local_diff_conditional_evaluate_invalid_diff():
   CHECKPOINT = {COMMIT: 'last-checkpoint'}
   from plumber.operators import LocalDiffConditional
   conditional = LocalDiffConditional()
-  conditional.configure(config, CHECKPOINT)
-  conditional.repo, commits, diffs = get_repo_mock()
+  conditional.configure(config, CHECKPOINT, DiffService(get_repo_mock()))
 
   try:
     _ = conditional.evaluate()
@@ -340,8 +406,7 @@ def test_local_diff_conditional_evaluate_invalid_diff_path():
   CHECKPOINT = {COMMIT: 'last-checkpoint'}
   from plumber.operators import LocalDiffConditional
   conditional = LocalDiffConditional()
-  conditional.configure(config, CHECKPOINT)
-  conditional.repo, commits, diffs = get_repo_mock()
+  conditional.configure(config, CHECKPOINT, DiffService(get_repo_mock()))
   assert conditional.evaluate() is False
 
 
@@ -357,8 +422,7 @@ def test_local_diff_conditional_evaluate_invalid_diff_expression_id():
   CHECKPOINT = {COMMIT: 'last-checkpoint'}
   from plumber.operators import LocalDiffConditional
   conditional = LocalDiffConditional()
-  conditional.configure(config, CHECKPOINT)
-  conditional.repo, commits, diffs = get_repo_mock()
+  conditional.configure(config, CHECKPOINT, DiffService(get_repo_mock()))
 
   try:
     _ = conditional.evaluate()
@@ -367,6 +431,28 @@ def test_local_diff_conditional_evaluate_invalid_diff_expression_id():
     assert type(e) is NameError
 
 
+def test_local_diff_conditional_expression_skips_expensive_rules():
+  config = {
+    ID: 'conditional',
+    EXPRESSION: 'b or a',
+    DIFF: [{
+      ID: 'a',
+      PATH: 'mypath/.*'
+    }, {
+      ID: 'b',
+      PATH: 'path1/.*',
+      CONTENT: '.*'
+    }]
+  }
+  CHECKPOINT = {COMMIT: 'last-checkpoint'}
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, CHECKPOINT, DiffService(get_repo_mock()))
+  conditional._has_content_diff = MagicMock()
+  assert conditional.evaluate() is True
+  conditional._has_content_diff.assert_not_called()
+
+
 def test_local_diff_conditional_evaluate_multiple_with_expression():
   config = {
     ID: 'conditional',
@@ -382,8 +468,7 @@ def test_local_diff_conditional_evaluate_multiple_with_expression():
   CHECKPOINT = {COMMIT: 'last-checkpoint'}
   from plumber.operators import LocalDiffConditional
   conditional = LocalDiffConditional()
-  conditional.configure(config, CHECKPOINT)
-  conditional.repo, commits, diffs = get_repo_mock()
+  conditional.configure(config, CHECKPOINT, DiffService(get_repo_mock()))
   assert conditional.evaluate() is True
 
 
@@ -403,8 +488,7 @@ def test_local_diff_conditional_evaluate_multiple_with_expression_content():
   CHECKPOINT = {COMMIT: 'last-checkpoint'}
   from plumber.operators import LocalDiffConditional
   conditional = LocalDiffConditional()
-  conditional.configure(config, CHECKPOINT)
-  conditional.repo, commits, diffs = get_repo_mock()
+  conditional.configure(config, CHECKPOINT, DiffService(get_repo_mock()))
   assert conditional.evaluate() is True
 
 
@@ -430,6 +514,880 @@ def test_local_diff_conditional_create_checkpoint():
   assert new_checkpoint[COMMIT] == str(Repo().head.commit)
 
 
+def test_local_diff_conditional_configure_lazy_head():
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'mypath/.*'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  diff_service = DiffService(get_repo_mock())
+  diff_service.get_head_commit = MagicMock()
+  diff_service.get_head_commit.return_value = 'head'
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: 'last-checkpoint'}, diff_service)
+  diff_service.get_head_commit.assert_not_called()
+  assert conditional.create_checkpoint() == {COMMIT: 'head'}
+
+
+def test_local_diff_conditional_evaluate_single_range_diff(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  checkpoint = commit_file(repo_path, 'mypath/file1', 'a')
+  commit_file(repo_path, 'mypath/file1', 'b')
+  commit_file(repo_path, 'mypath/file1', 'a')
+  commit_file(repo_path, 'other/file1', 'a')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      ID: 'a',
+      PATH: 'mypath/.*'
+    }, {
+      ID: 'b',
+      PATH: '.*\\.md'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: checkpoint})
+  diffs = conditional._get_diffs_from_current()
+  assert list(diffs) == ['other/file1']
+  assert diffs['other/file1'].old_oid is None
+  assert diffs['other/file1'].new_oid is not None
+  assert conditional.evaluate() is False
+
+
+def test_local_diff_conditional_evaluate_shared_diff_service():
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      ID: 'a',
+      PATH: 'mypath/.*'
+    }]
+  }
+  CHECKPOINT = {COMMIT: 'last-checkpoint'}
+  diff_service = DiffService(get_repo_mock())
+  from plumber.operators import LocalDiffConditional
+  conditionals = [LocalDiffConditional() for _ in range(3)]
+  for conditional in conditionals:
+    conditional.configure(config, CHECKPOINT, diff_service)
+    assert conditional.evaluate() is True
+  diff_service.repo.git.diff_tree.assert_called_once()
+
+
+def test_local_diff_conditional_evaluate_pathspec_pushdown(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  checkpoint = commit_file(repo_path, 'services/billing/file1', 'a')
+  commit_file(repo_path, 'services/billing/file1', 'b')
+  commit_file(repo_path, 'services/auth/file1', 'b')
+  commit_file(repo_path, 'services/billings/file1', 'b')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'services/billing/.*'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: checkpoint})
+  assert conditional.pathspecs == ['services/billing']
+  assert list(conditional._get_diffs_from_current()) == [
+    'services/billing/file1']
+  assert conditional.evaluate() is True
+
+
+def test_local_diff_conditional_evaluate_target_branch(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  checkpoint = commit_file(repo_path, 'mypath/file1', 'a')
+  git(repo_path, 'checkout', '-q', '-b', 'testing')
+  commit_file(repo_path, 'mypath/file1', 'b')
+  git(repo_path, 'checkout', '-q', 'master')
+  commit_file(repo_path, 'other/file1', 'b')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'mypath/.*'
+    }],
+    BRANCH: {
+      TARGET: 'testing'
+    }
+  }
+  head = git(repo_path, 'rev-parse', 'HEAD')
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: checkpoint})
+  assert conditional.evaluate() is True
+  assert git(repo_path, 'rev-parse', 'HEAD') == head
+  assert git(repo_path, 'status', '--porcelain') == ''
+  assert conditional.create_checkpoint() == {COMMIT: head}
+
+
+def test_local_diff_conditional_evaluate_target_branch_not_found():
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'mypath/.*'
+    }],
+    BRANCH: {
+      TARGET: 'testing'
+    }
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: 'last-checkpoint'})
+  repo = get_repo_mock()
+  repo.remotes = []
+
+  def rev_parse(*args):
+    if args[-1].startswith('testing'):
+      raise GitCommandError('rev-parse', 1)
+    return 'last-checkpoint'
+
+  repo.git.rev_parse.side_effect = rev_parse
+  conditional.diff_service = DiffService(repo)
+  try:
+    conditional.evaluate()
+    pytest.fail('Conditional should not evaluate without target branch')
+  except Exception as e:
+    assert type(e) is ExecutionFailure
+
+
+def test_local_diff_conditional_evaluate_content_hunks(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'mypath/values.yml', 'name: a\nimage: a\n')
+  with open(os.path.join(repo_path, 'mypath/blob.bin'), 'wb') as file:
+    file.write(b'\x00\x01name: a')
+  checkpoint = commit_file(repo_path, 'mypath/large.txt', 'name: a\n')
+  commit_file(repo_path, 'mypath/values.yml', 'name: a\n')
+  with open(os.path.join(repo_path, 'mypath/blob.bin'), 'wb') as file:
+    file.write(b'\x00\x01name: b')
+  commit_file(repo_path, 'mypath/large.txt', 'name: b\n' * 100)
+  monkeypatch.chdir(repo_path)
+
+  def evaluate(diff):
+    from plumber.operators import LocalDiffConditional
+    conditional = LocalDiffConditional()
+    conditional.configure({ID: 'conditional', DIFF: [diff]},
+                          {COMMIT: checkpoint})
+    return conditional.evaluate()
+
+  assert evaluate({PATH: 'mypath/values.yml', CONTENT: 'image:.*'}) is True
+  assert evaluate({PATH: 'mypath/values.yml', CONTENT: 'name:.*'}) is False
+  assert evaluate({PATH: 'mypath/blob.bin', CONTENT: '.*'}) is False
+  assert evaluate({PATH: 'mypath/large.txt', CONTENT: 'name: b'}) is True
+  assert evaluate(
+      {PATH: 'mypath/large.txt', CONTENT: 'name: b', MAX_SIZE: 100}) is True
+  assert evaluate(
+      {PATH: 'mypath/large.txt', CONTENT: 'name: c', MAX_SIZE: 100}) is False
+  assert evaluate(
+      {PATH: 'mypath/large.txt', CONTENT: r'name: \d', MAX_SIZE: 100}) is True
+  assert evaluate(
+      {PATH: 'mypath/large.txt', KEYS: ['name'], MAX_SIZE: 100}) is True
+
+
+def test_local_diff_conditional_evaluate_content_single_diff(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'mypath/a.yml', 'name: a\n')
+  with open(os.path.join(repo_path, 'mypath/blob.bin'), 'wb') as file:
+    file.write(b'\x00\x01name: a')
+  checkpoint = commit_file(repo_path, 'mypath/b.yml', 'name: a\n')
+  commit_file(repo_path, 'mypath/a.yml', 'name: b\n')
+  with open(os.path.join(repo_path, 'mypath/blob.bin'), 'wb') as file:
+    file.write(b'\x00\x01image: b')
+  commit_file(repo_path, 'mypath/b.yml', 'image: b\n')
+  monkeypatch.chdir(repo_path)
+  import plumber.diffs
+  iter_changed_lines = MagicMock(wraps=plumber.diffs.iter_changed_lines)
+  monkeypatch.setattr(plumber.diffs, 'iter_changed_lines', iter_changed_lines)
+
+  def evaluate(content):
+    iter_changed_lines.reset_mock()
+    from plumber.operators import LocalDiffConditional
+    conditional = LocalDiffConditional()
+    conditional.configure({ID: 'conditional', DIFF: [
+      {PATH: 'mypath/.*', CONTENT: content}]}, {COMMIT: checkpoint})
+    return conditional.evaluate()
+
+  assert evaluate('image: b') is True
+  assert iter_changed_lines.call_count == 1
+  assert sorted(iter_changed_lines.call_args[0][3]) == ['mypath/a.yml',
+                                                        'mypath/b.yml',
+                                                        'mypath/blob.bin']
+  assert evaluate('name: b') is True
+  assert evaluate('.*\x01') is False
+  assert iter_changed_lines.call_count == 1
+
+
+def test_local_diff_conditional_evaluate_content_pickaxe(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  checkpoint = commit_file(repo_path, 'mypath/values.yml',
+                           'name: a\nimage: a\n')
+  commit_file(repo_path, 'mypath/values.yml', 'name: a\nimage: b\n')
+  monkeypatch.chdir(repo_path)
+
+  def evaluate(content):
+    from plumber.operators import LocalDiffConditional
+    conditional = LocalDiffConditional()
+    conditional.configure({ID: 'conditional', DIFF: [
+      {PATH: 'mypath/.*', CONTENT: content, PICKAXE: True}]},
+                          {COMMIT: checkpoint})
+    conditional.diff_service.iter_changed_lines = MagicMock()
+    conditional.diff_service.iter_changed_lines.return_value = iter([])
+    result = conditional.evaluate()
+    return result, conditional.diff_service.iter_changed_lines.called
+
+  assert evaluate('image: b') == (True, False)
+  assert evaluate('name:.*') == (False, False)
+  assert evaluate('ima') == (True, False)
+  assert evaluate(r'image:\s+b') == (False, True)
+
+
+def test_local_diff_conditional_evaluate_persistent_cache(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  checkpoint = commit_file(repo_path, 'mypath/file1', 'name: a')
+  commit_file(repo_path, 'mypath/file1', 'name: b')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'mypath/.*',
+      CONTENT: 'name: b'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  for run in range(2):
+    diff_service = DiffService(cache_config={})
+    conditional = LocalDiffConditional()
+    conditional.configure(config, {COMMIT: checkpoint}, diff_service)
+    if run == 1:
+      diff_service.get_cache()
+      diff_service.get_head_commit()
+      diff_service.repo = MagicMock(wraps=diff_service.repo)
+    assert conditional.evaluate() is True
+    diff_service.close()
+  diff_service.repo.git.diff_tree.assert_not_called()
+  diff_service.repo.git.diff.assert_not_called()
+  assert os.path.exists(
+      os.path.join(repo_path, '.git', 'plumber', 'cache.sqlite'))
+
+
+def test_local_diff_conditional_evaluate_checkpoint_not_ancestor(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'mypath/file1', 'a')
+  git(repo_path, 'checkout', '-q', '-b', 'rewritten')
+  checkpoint = commit_file(repo_path, 'mypath/file1', 'b')
+  git(repo_path, 'checkout', '-q', 'master')
+  commit_file(repo_path, 'other/file1', 'b')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'other/.*'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: checkpoint})
+  assert conditional.evaluate() is True
+  assert conditional.diff_service.is_ancestor(
+      checkpoint, conditional.new_checkpoint) is False
+  assert set(conditional._get_diffs_from_current()) == {'other/file1'}
+
+
+def test_local_diff_conditional_evaluate_subtree_short_circuit(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'services/billing/file1', 'a')
+  checkpoint = commit_file(repo_path, 'services/auth/file1', 'a')
+  commit_file(repo_path, 'services/auth/file1', 'b')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'services/billing/.*'
+    }, {
+      PATH: 'services/auth/.*\\.py'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: checkpoint})
+  conditional.diff_service.get_head_commit()
+  conditional.diff_service.repo = MagicMock(wraps=conditional.diff_service.repo)
+  assert conditional.evaluate() is False
+  assert conditional._get_diff_range()[3] == ['services/auth']
+  conditional.diff_service.repo.git.diff_tree.assert_called_once()
+
+  config[DIFF].pop()
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: checkpoint})
+  conditional.diff_service.get_head_commit()
+  conditional.diff_service.repo = MagicMock(wraps=conditional.diff_service.repo)
+  assert conditional.evaluate() is False
+  conditional.diff_service.repo.git.diff_tree.assert_not_called()
+
+
+def test_local_diff_conditional_tree_checkpoint(tmp_path, monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'services/billing/file1', 'a')
+  head = commit_file(repo_path, 'services/auth/file1', 'a')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    'checkpoint': TREE,
+    DIFF: [{
+      PATH: 'services/billing/.*'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {})
+  assert conditional.create_checkpoint() == {
+    COMMIT: head,
+    TREE: git(repo_path, 'rev-parse', 'HEAD^{tree}'),
+    PREFIXES: {
+      'services/billing': git(repo_path, 'rev-parse',
+                              'HEAD:services/billing')
+    }
+  }
+
+
+def test_local_diff_conditional_tree_checkpoint_invalid_format():
+  config = {
+    ID: 'conditional',
+    'checkpoint': 'something',
+    DIFF: []
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  with pytest.raises(ConfigError):
+    conditional.configure(config, {}, DiffService(get_repo_mock()))
+
+
+def test_local_diff_conditional_evaluate_tree_checkpoint_rewritten(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'services/billing/file1', 'a')
+  tree = git(repo_path, 'rev-parse', 'HEAD^{tree}')
+  commit_file(repo_path, 'services/auth/file1', 'a')
+  monkeypatch.chdir(repo_path)
+  from plumber.operators import LocalDiffConditional
+  results = {}
+  for path in ['services/billing/.*', 'services/auth/.*']:
+    conditional = LocalDiffConditional()
+    conditional.configure({
+      ID: 'conditional',
+      DIFF: [{
+        PATH: path
+      }]
+    }, {COMMIT: 'f' * 40, TREE: tree})
+    results[path] = conditional.evaluate()
+    assert conditional.diff_service.commits == {}
+    assert conditional.diff_service.ancestry == {}
+  assert results == {'services/billing/.*': False, 'services/auth/.*': True}
+
+
+def test_local_diff_conditional_evaluate_tree_checkpoint_prefixes(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'services/billing/file1', 'a')
+  commit_file(repo_path, 'services/auth/file1', 'a')
+  billing = git(repo_path, 'rev-parse', 'HEAD:services/billing')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'services/billing/.*'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {TREE: 'f' * 40,
+                                 PREFIXES: {'services/billing': billing}})
+  assert conditional.evaluate() is False
+  assert conditional._get_diffs_from_current() == {}
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {TREE: 'f' * 40,
+                                 PREFIXES: {'services/billing': 'e' * 40}})
+  assert conditional.evaluate() is True
+
+
+def test_local_diff_conditional_evaluate_logs_touching_commits(tmp_path,
+    monkeypatch, caplog):
+  repo_path = create_test_repo(str(tmp_path))
+  checkpoint = commit_file(repo_path, 'services/billing/file1', 'a')
+  billing = commit_file(repo_path, 'services/billing/file1', 'b')
+  auth = commit_file(repo_path, 'services/auth/file1', 'a')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'services/billing/.*'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: checkpoint})
+  with caplog.at_level('INFO'):
+    assert conditional.evaluate() is True
+  assert billing in caplog.text
+  assert auth not in caplog.text
+
+
+def test_local_diff_conditional_evaluate_touching_commits_failure(tmp_path,
+    monkeypatch, caplog):
+  repo_path = create_test_repo(str(tmp_path))
+  checkpoint = commit_file(repo_path, 'services/billing/file1', 'a')
+  commit_file(repo_path, 'services/billing/file1', 'b')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'services/billing/.*'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: checkpoint})
+  conditional.diff_service.get_touching_commits = MagicMock()
+  conditional.diff_service.get_touching_commits.side_effect = OSError(
+      7, 'Argument list too long')
+  with caplog.at_level('INFO'):
+    assert conditional.evaluate() is True
+  assert 'Argument list too long' in caplog.text
+
+
+def test_local_diff_conditional_evaluate_shallow_clone(tmp_path,
+    monkeypatch):
+  origin_path, clone_path = create_shallow_clone(str(tmp_path), [
+    ('services/billing/file1', 'a'), ('services/auth/file1', 'a')] + [
+    ('services/auth/file1', str(i)) for i in range(5)])
+  checkpoint = git(origin_path, 'rev-parse', 'HEAD~5')
+  monkeypatch.chdir(clone_path)
+  from plumber.operators import LocalDiffConditional
+  diff_service = DiffService(shallow_config={'depth': 2})
+  results = {}
+  for path in ['services/billing/.*', 'services/auth/.*']:
+    conditional = LocalDiffConditional()
+    conditional.configure({
+      ID: path,
+      DIFF: [{
+        PATH: path
+      }]
+    }, {COMMIT: checkpoint}, diff_service)
+    results[path] = conditional.evaluate()
+  assert results == {'services/billing/.*': False, 'services/auth/.*': True}
+  assert diff_service.deepened == 6
+  assert diff_service.is_shallow()
+
+
+def test_local_diff_conditional_evaluate_shallow_clone_limit(tmp_path,
+    monkeypatch):
+  origin_path, clone_path = create_shallow_clone(str(tmp_path), [
+    ('services/billing/file1', str(i)) for i in range(5)])
+  checkpoint = git(origin_path, 'rev-parse', 'HEAD~4')
+  monkeypatch.chdir(clone_path)
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure({
+    ID: 'conditional',
+    DIFF: [{
+      PATH: 'services/auth/.*'
+    }]
+  }, {COMMIT: checkpoint}, DiffService(shallow_config={'depth': 1,
+                                                       'maxdepth': 2}))
+  assert conditional.prepare() is False
+  assert conditional.evaluate() is True
+  assert conditional.diff_service.deepened == 2
+
+
+def lfs_pointer(oid, size, extension=''):
+  return 'version https://git-lfs.github.com/spec/v1\n{}oid sha256:{}\n' \
+         'size {}\n'.format(extension, oid * 64, size)
+
+
+def test_local_diff_conditional_evaluate_lfs(tmp_path, monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, '.gitattributes', '*.bin filter=lfs -text\n')
+  commit_file(repo_path, 'assets/same.bin', lfs_pointer('a', 10))
+  checkpoint = commit_file(repo_path, 'assets/changed.bin',
+                           lfs_pointer('b', 10))
+  commit_file(repo_path, 'assets/same.bin',
+              lfs_pointer('a', 10, 'ext-0-foo sha256:{}\n'.format('c' * 64)))
+  commit_file(repo_path, 'assets/changed.bin', lfs_pointer('d', 20))
+  monkeypatch.chdir(repo_path)
+  from plumber.operators import LocalDiffConditional
+  results = {}
+  for name, target_diff in [('same', {PATH: 'assets/same\\.bin'}),
+                            ('changed', {PATH: 'assets/changed\\.bin'}),
+                            ('content', {PATH: 'assets/.*', CONTENT: 'size.*'}),
+                            ('pickaxe', {PATH: 'assets/.*', CONTENT: 'size',
+                                         PICKAXE: True})]:
+    conditional = LocalDiffConditional()
+    conditional.configure({ID: name, DIFF: [target_diff]},
+                          {COMMIT: checkpoint})
+    results[name] = conditional.evaluate()
+  assert results == {'same': False, 'changed': True, 'content': False,
+                     'pickaxe': False}
+
+
+def test_local_diff_conditional_evaluate_lfs_untracked(tmp_path, monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, '.gitattributes', '*.bin filter=lfs -text\n')
+  checkpoint = commit_file(repo_path, 'assets/same.txt', lfs_pointer('a', 10))
+  commit_file(repo_path, 'assets/same.txt',
+              lfs_pointer('a', 10, 'ext-0-foo sha256:{}\n'.format('c' * 64)))
+  monkeypatch.chdir(repo_path)
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure({ID: 'conditional', DIFF: [{PATH: 'assets/.*'}]},
+                        {COMMIT: checkpoint})
+  conditional.diff_service.get_object_size = MagicMock()
+  assert conditional.evaluate() is True
+  conditional.diff_service.get_object_size.assert_not_called()
+  assert conditional.diff_service.get_lfs_paths(
+      ['assets/same.txt', 'assets/other.bin']) == {'assets/other.bin'}
+
+
+def test_local_diff_conditional_evaluate_submodules(tmp_path, monkeypatch):
+  sub_path = os.path.join(str(tmp_path), 'sub')
+  os.makedirs(sub_path)
+  create_test_repo(sub_path)
+  commit_file(sub_path, 'inner/file1', 'name: a')
+  commit_file(sub_path, 'other/file1', 'a')
+  repo_path = os.path.join(str(tmp_path), 'repo')
+  os.makedirs(repo_path)
+  create_test_repo(repo_path)
+  commit_file(repo_path, 'README.md', 'a')
+  git(repo_path, '-c', 'protocol.file.allow=always', 'submodule', 'add', '-q',
+      sub_path, 'lib')
+  git(repo_path, 'commit', '-q', '-m', 'add submodule')
+  checkpoint = git(repo_path, 'rev-parse', 'HEAD')
+  git(os.path.join(repo_path, 'lib'), 'config', 'user.email', 'plumber@test')
+  git(os.path.join(repo_path, 'lib'), 'config', 'user.name', 'plumber')
+  commit_file(os.path.join(repo_path, 'lib'), 'inner/file1', 'name: b')
+  git(repo_path, 'commit', '-q', '-am', 'move submodule')
+  monkeypatch.chdir(repo_path)
+  from plumber.operators import LocalDiffConditional
+  diff_service = DiffService()
+  results = {}
+  for name, submodules, target_diff in [
+    ('inner', True, {PATH: 'lib/inner/.*'}),
+    ('other', True, {PATH: 'lib/other/.*'}),
+    ('disabled', False, {PATH: 'lib/inner/.*'}),
+    ('gitlink', False, {PATH: 'lib'}),
+    ('content', True, {PATH: 'lib/.*', CONTENT: 'name: b'}),
+    ('no content', True, {PATH: 'lib/.*', CONTENT: 'name: c'}),
+    ('pickaxe', True, {PATH: 'lib/.*', CONTENT: 'name: b', PICKAXE: True})]:
+    conditional = LocalDiffConditional()
+    conditional.configure({ID: name, SUBMODULES: submodules,
+                           DIFF: [target_diff]}, {COMMIT: checkpoint},
+                          diff_service)
+    results[name] = conditional.evaluate()
+  assert results == {'inner': True, 'other': False, 'disabled': False,
+                     'gitlink': True, 'content': True, 'no content': False,
+                     'pickaxe': True}
+  assert set(conditional._get_diffs_from_current()) == {'lib/inner/file1'}
+
+
+def test_local_diff_conditional_evaluate_submodules_uninitialized(tmp_path,
+    monkeypatch):
+  sub_path = os.path.join(str(tmp_path), 'sub')
+  os.makedirs(sub_path)
+  create_test_repo(sub_path)
+  commit_file(sub_path, 'inner/file1', 'name: a')
+  repo_path = os.path.join(str(tmp_path), 'repo')
+  os.makedirs(repo_path)
+  create_test_repo(repo_path)
+  commit_file(repo_path, 'README.md', 'a')
+  git(repo_path, '-c', 'protocol.file.allow=always', 'submodule', 'add', '-q',
+      sub_path, 'lib')
+  git(repo_path, 'commit', '-q', '-m', 'add submodule')
+  checkpoint = git(repo_path, 'rev-parse', 'HEAD')
+  git(os.path.join(repo_path, 'lib'), 'config', 'user.email', 'plumber@test')
+  git(os.path.join(repo_path, 'lib'), 'config', 'user.name', 'plumber')
+  commit_file(os.path.join(repo_path, 'lib'), 'inner/file1', 'name: b')
+  git(repo_path, 'commit', '-q', '-am', 'move submodule')
+  git(repo_path, 'submodule', 'deinit', '-q', '-f', 'lib')
+  monkeypatch.chdir(repo_path)
+  from plumber.operators import LocalDiffConditional
+  cache_config = {PATH: os.path.join(str(tmp_path), 'cache.sqlite')}
+
+  def evaluate():
+    diff_service = DiffService(cache_config=cache_config,
+                               shallow_config={DEPTH: 8})
+    conditional = LocalDiffConditional()
+    conditional.configure({ID: 'conditional', SUBMODULES: True,
+                           DIFF: [{PATH: 'lib($|/other/.*)'}]},
+                          {COMMIT: checkpoint}, diff_service)
+    try:
+      return conditional.evaluate(), diff_service
+    finally:
+      diff_service.close()
+
+  assert evaluate()[0] is True
+  git(repo_path, 'submodule', 'update', '-q', '--init', 'lib')
+  result, diff_service = evaluate()
+  assert result is False
+  submodule = diff_service.get_submodule_service('lib')
+  assert submodule.deepen_depth == 8
+  assert submodule.get_repo().git._environment['GIT_LFS_SKIP_SMUDGE'] == '1'
+
+
+def test_local_diff_conditional_evaluate_keys(tmp_path, monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'charts/a/values.yaml',
+              'image:\n  tag: 1.0\nreplicas: 1\n')
+  commit_file(repo_path, 'charts/b/values.json',
+              '{"image": {"tag": "1.0"}, "replicas": 1}')
+  checkpoint = commit_file(repo_path, 'charts/c/values.yaml', 'a: 1\n')
+  commit_file(repo_path, 'charts/a/values.yaml',
+              '# comment\nimage:\n  tag: 1.0\nreplicas: 2\n')
+  commit_file(repo_path, 'charts/b/values.json',
+              '{"image": {"tag": "1.1"}, "replicas": 1}')
+  commit_file(repo_path, 'charts/c/values.yaml', 'a: [1\n')
+  monkeypatch.chdir(repo_path)
+  import plumber.diffs
+  parsed = []
+  parse_document = plumber.diffs.parse_document
+  monkeypatch.setattr(plumber.diffs, 'parse_document', lambda data, path: (
+      parsed.append(path), parse_document(data, path))[1])
+  from plumber.operators import LocalDiffConditional
+  diff_service = DiffService()
+  results = {}
+  for name, target_diff in [
+    ('yaml tag', {PATH: 'charts/a/.*', KEYS: ['image.tag']}),
+    ('yaml replicas', {PATH: 'charts/a/.*', KEYS: ['image', 'replicas']}),
+    ('json tag', {PATH: 'charts/b/.*', KEYS: ['image.tag']}),
+    ('json replicas', {PATH: 'charts/b/.*', KEYS: ['replicas']}),
+    ('invalid', {PATH: 'charts/c/.*', KEYS: ['a']})]:
+    conditional = LocalDiffConditional()
+    conditional.configure({ID: name, DIFF: [target_diff]},
+                          {COMMIT: checkpoint}, diff_service)
+    results[name] = conditional.evaluate()
+  assert results == {'yaml tag': False, 'yaml replicas': True,
+                     'json tag': True, 'json replicas': False,
+                     'invalid': True}
+  assert sorted(parsed) == ['charts/a/values.yaml', 'charts/a/values.yaml',
+                            'charts/b/values.json', 'charts/b/values.json',
+                            'charts/c/values.yaml', 'charts/c/values.yaml']
+  conditional = LocalDiffConditional()
+  with pytest.raises(ConfigError):
+    conditional.configure({ID: 'invalid', EXPRESSION: 'a or b', DIFF: [
+      {ID: 'a', PATH: 'charts/a/.*'},
+      {ID: 'b', PATH: 'charts/a/.*', KEYS: ['image.tag'], CONTENT: 'tag'}]},
+                          {COMMIT: checkpoint}, diff_service)
+
+
+def test_local_diff_conditional_evaluate_checkpoint_not_found(tmp_path,
+    monkeypatch):
+  repo_path = create_test_repo(str(tmp_path))
+  commit_file(repo_path, 'mypath/file1', 'a')
+  monkeypatch.chdir(repo_path)
+  config = {
+    ID: 'conditional',
+    DIFF: [{
+      ID: 'a',
+      PATH: 'mypath/.*'
+    }]
+  }
+  from plumber.operators import LocalDiffConditional
+  conditional = LocalDiffConditional()
+  conditional.configure(config, {COMMIT: 'f' * 40})
+  assert conditional.evaluate() is True
+
+
+################################################
+# WorktreeConditional Tests
+################################################
+
+
+def create_worktree_repo(path):
+  repo_path = create_test_repo(path)
+  commit_file(repo_path, '.gitignore', 'ignored/\n')
+  commit_file(repo_path, 'services/billing/file1', 'a')
+  commit_file(repo_path, 'services/auth/file1', 'a')
+  commit_file(repo_path, 'services/deleted/file1', 'a')
+  return repo_path
+
+
+def write_file(repo_path, path, content, mtime=None):
+  file_path = os.path.join(repo_path, path)
+  os.makedirs(os.path.dirname(file_path), exist_ok=True)
+  with open(file_path, 'w') as file:
+    file.write(content)
+  if mtime is not None:
+    os.utime(file_path, (mtime, mtime))
+
+
+def test_worktree_conditional_config():
+  conditional = WorktreeConditional()
+  with pytest.raises(ConfigError):
+    conditional.configure({DIFF: []}, {}, DiffService(get_repo_mock()))
+  with pytest.raises(ConfigError):
+    conditional.configure({ID: 'worktree'}, {}, DiffService(get_repo_mock()))
+  for field, value in [(CONTENT, 'a'), (KEYS, ['a']), (PICKAXE, True),
+                       (MAX_SIZE, 1024)]:
+    with pytest.raises(ConfigError):
+      conditional.configure({ID: 'worktree', DIFF: [{PATH: '.*',
+                                                     field: value}]}, {},
+                            DiffService(get_repo_mock()))
+  conditional.configure({ID: 'worktree', DIFF: [{PATH: 'services/.*'}]}, {},
+                        DiffService(get_repo_mock()))
+  assert conditional.pathspecs == ['services']
+  assert conditional.create_checkpoint() == {}
+
+
+def test_worktree_conditional_evaluate(tmp_path, monkeypatch):
+  repo_path = create_worktree_repo(str(tmp_path))
+  write_file(repo_path, 'services/billing/file1', 'b')
+  write_file(repo_path, 'services/new/file1', 'a')
+  write_file(repo_path, 'ignored/file1', 'a')
+  os.remove(os.path.join(repo_path, 'services/deleted/file1'))
+  monkeypatch.chdir(repo_path)
+  diff_service = DiffService()
+  assert set(diff_service.get_worktree_changes()) == {
+    'services/billing/file1', 'services/new/file1', 'services/deleted/file1'}
+  results = {}
+  for path in ['services/billing/.*', 'services/auth/.*', 'services/new/.*',
+               'services/deleted/.*', 'ignored/.*', '.*auth.*']:
+    conditional = WorktreeConditional()
+    conditional.configure({ID: path, DIFF: [{PATH: path}]}, {}, diff_service)
+    results[path] = conditional.evaluate()
+  assert results == {'services/billing/.*': True, 'services/auth/.*': False,
+                     'services/new/.*': True, 'services/deleted/.*': True,
+                     'ignored/.*': False, '.*auth.*': False}
+  conditional = WorktreeConditional()
+  conditional.configure({ID: 'expression', EXPRESSION: 'billing and not auth',
+                         DIFF: [{ID: 'billing', PATH: 'services/billing/.*'},
+                                {ID: 'auth', PATH: 'services/auth/.*'}]}, {},
+                        diff_service)
+  assert conditional.evaluate() is True
+
+
+def test_worktree_conditional_stat_cache(tmp_path, monkeypatch):
+  repo_path = create_worktree_repo(str(tmp_path))
+  past = 1500000000
+  write_file(repo_path, 'services/billing/file1', 'b', past)
+  write_file(repo_path, 'services/auth/file1', 'a', past)
+  write_file(repo_path, 'services/deleted/file1', 'a', past)
+  monkeypatch.chdir(repo_path)
+  import plumber.worktree
+  hashed = []
+  hash_paths = plumber.worktree.hash_paths
+  monkeypatch.setattr(plumber.worktree, 'hash_paths', lambda repo, paths: (
+      hashed.extend(paths), hash_paths(repo, paths))[1])
+  config = {ID: 'worktree', DIFF: [{PATH: 'services/billing/.*'}]}
+  conditional = WorktreeConditional()
+  conditional.configure(config, {}, DiffService())
+  assert conditional.evaluate() is True
+  assert hashed == ['services/billing/file1']
+  conditional.diff_service.close()
+  hashed.clear()
+  conditional = WorktreeConditional()
+  conditional.configure(config, {}, DiffService())
+  assert conditional.evaluate() is True
+  assert hashed == []
+  conditional.diff_service.close()
+  write_file(repo_path, 'services/billing/file1', 'a', past + 1)
+  conditional = WorktreeConditional()
+  conditional.configure(config, {}, DiffService())
+  assert conditional.evaluate() is False
+  assert hashed == ['services/billing/file1']
+
+
+################################################
+# FileHashConditional Tests
+################################################
+
+
+def test_file_hash_conditional_config():
+  conditional = FileHashConditional()
+  with pytest.raises(ConfigError):
+    conditional.configure({PATH: 'artifacts'}, {})
+  with pytest.raises(ConfigError):
+    conditional.configure({ID: 'artifacts'}, {})
+  with pytest.raises(ConfigError):
+    conditional.configure({ID: 'artifacts', PATH: 'artifacts',
+                           DIFF: [{PATH: '.*', CONTENT: 'a'}]}, {})
+  conditional.configure({ID: 'artifacts', PATH: 'artifacts'}, {})
+  assert conditional.root == 'artifacts'
+  assert conditional.target_diffs == []
+
+
+def test_file_hash_conditional_evaluate(tmp_path):
+  root = str(tmp_path)
+  write_file(root, 'lib/file1', 'a')
+  write_file(root, 'lib/file2', 'a')
+  write_file(root, 'docs/file1', 'a')
+  config = {ID: 'artifacts', PATH: root}
+  conditional = FileHashConditional()
+  conditional.configure(config, {})
+  assert conditional.evaluate() is True
+  checkpoint = conditional.create_checkpoint()
+  assert set(checkpoint[FILES]) == {'lib/file1', 'lib/file2', 'docs/file1'}
+  assert checkpoint[FILES]['lib/file1'][2] == hashlib.sha256(
+      b'a').hexdigest()
+  conditional = FileHashConditional()
+  conditional.configure(config, checkpoint)
+  assert conditional.evaluate() is False
+  write_file(root, 'lib/file1', 'b')
+  os.remove(os.path.join(root, 'lib/file2'))
+  results = {}
+  for name, target_diffs, expression in [
+    ('any', None, None), ('lib', [{PATH: 'lib/.*'}], None),
+    ('docs', [{PATH: 'docs/.*'}], None),
+    ('expression', [{ID: 'lib', PATH: 'lib/file2'},
+                    {ID: 'docs', PATH: 'docs/.*'}], 'lib and not docs')]:
+    config = {ID: name, PATH: root}
+    if target_diffs is not None:
+      config[DIFF] = target_diffs
+    if expression is not None:
+      config[EXPRESSION] = expression
+    conditional = FileHashConditional()
+    conditional.configure(config, checkpoint)
+    results[name] = conditional.evaluate()
+  assert results == {'any': True, 'lib': True, 'docs': False,
+                     'expression': True}
+  assert 'lib/file2' not in conditional.create_checkpoint()[FILES]
+
+
+def test_file_hash_conditional_skips_unchanged_stats(tmp_path, monkeypatch):
+  root = str(tmp_path)
+  past = 1500000000
+  write_file(root, 'file1', 'a', past)
+  write_file(root, 'file2', 'a', past)
+  conditional = FileHashConditional()
+  conditional.configure({ID: 'artifacts', PATH: root}, {})
+  checkpoint = conditional.create_checkpoint()
+  import plumber.manifest
+  hashed = []
+  hash_file = plumber.manifest.hash_file
+  monkeypatch.setattr(plumber.manifest, 'hash_file', lambda path: (
+      hashed.append(os.path.basename(path)), hash_file(path))[1])
+  write_file(root, 'file2', 'b', past)
+  conditional = FileHashConditional()
+  conditional.configure({ID: 'artifacts', PATH: root, WORKERS: 2}, checkpoint)
+  assert conditional.evaluate() is False
+  assert hashed == []
+  write_file(root, 'file2', 'b', past + 1)
+  conditional = FileHashConditional()
+  conditional.configure({ID: 'artifacts', PATH: root}, checkpoint)
+  assert conditional.evaluate() is True
+  assert hashed == ['file2']
+
+
 ################################################
 # Executor Tests
 ################################################
@@ -916,12 +1874,64 @@ def test_pipe_configure():
   from plumber.core import PlumberPipe
   pipe = PlumberPipe()
   pipe.configure(PIPE_CONFIG, CHECKPOINT)
-  LocalDiffConditional.configure.assert_called()
+  LocalDiffConditional.configure.assert_not_called()
   assert len(pipe.conditions) == 2
+  assert LocalDiffConditional.configure.call_count == 2
   assert pipe.checkpoint is CHECKPOINT
   assert pipe.actions is not None
 
 
+def test_pipe_configure_lazy():
+  PIPE_CONFIG = {
+    ID: 'test-pipe',
+    CONDITIONS: [
+      {
+        ID: 'c1',
+        DIFF: [
+          {
+            PATH: 'test-path/.*'
+          }
+        ]
+      }
+    ],
+    ACTIONS: {
+      STEPS: [
+      ]
+    }
+  }
+  from plumber.core import LocalDiffConditional
+  LocalDiffConditional.configure = MagicMock()
+  LocalDiffConditional.configure.return_value = None
+  from plumber.core import PlumberPipe
+  diff_service = DiffService(get_repo_mock())
+  pipe = PlumberPipe()
+  pipe.configure(PIPE_CONFIG, {}, diff_service)
+  LocalDiffConditional.configure.assert_not_called()
+  assert pipe._actions is None
+  conditions = pipe.conditions
+  assert pipe.conditions is conditions
+  LocalDiffConditional.configure.assert_called_once()
+  from plumber.operators import Executor
+  assert type(pipe.actions) is Executor
+  assert pipe.actions is pipe.actions
+
+
+def test_pipe_configure_validates_conditions():
+  from plumber.core import LocalDiffConditional
+  LocalDiffConditional.configure = MagicMock()
+  LocalDiffConditional.configure.return_value = None
+  from plumber.core import PlumberPipe
+  for condition_config in [{ID: 'c1', TYPE: 'bogus'},
+                           {ID: 'c1', EXPRESSION: 'a and ('}]:
+    pipe = PlumberPipe()
+    with pytest.raises(ConfigError):
+      pipe.configure({ID: 'test-pipe', CONDITIONS: [condition_config]}, {})
+  pipe = PlumberPipe()
+  with pytest.raises(ConfigError):
+    pipe.configure({ID: 'test-pipe', ACTIONS: {}}, {})
+  LocalDiffConditional.configure.assert_not_called()
+
+
 def test_pipe_configure_no_id():
   from plumber.core import PlumberPipe
   pipe = PlumberPipe()
@@ -1146,6 +2156,46 @@ def test_pipe_evaluate_false():
   pipe.conditions[1][CONDITION].evaluate.assert_called_once()
 
 
+def test_pipe_configure_invalid_expression():
+  from plumber.core import PlumberPipe
+  pipe = PlumberPipe()
+  with pytest.raises(ConfigError):
+    pipe.configure({ID: 'test-pipe', EXPRESSION: 'open("x")'}, {})
+
+
+def test_pipe_evaluate_expression_lazy():
+  PIPE_CONFIG = {
+    ID: 'test-pipe',
+    EXPRESSION: 'a or b',
+    CONDITIONS: [
+      {
+        ID: 'a'
+      },
+      {
+        ID: 'b'
+      }
+    ],
+    ACTIONS: {
+      STEPS: [
+      ]
+    }
+  }
+  from plumber.core import LocalDiffConditional
+  LocalDiffConditional.configure = MagicMock()
+  LocalDiffConditional.configure.return_value = None
+  from plumber.core import PlumberPipe
+  pipe = PlumberPipe()
+  pipe.configure(PIPE_CONFIG, {})
+  pipe.conditions[0][CONDITION].target_branch = 'master'
+  pipe.conditions[0][CONDITION].evaluate = MagicMock()
+  pipe.conditions[0][CONDITION].evaluate.return_value = True
+  pipe.conditions[1][CONDITION].evaluate = MagicMock()
+  pipe.conditions[1][CONDITION].evaluate.return_value = True
+  assert pipe.evaluate() is True
+  pipe.conditions[0][CONDITION].evaluate.assert_not_called()
+  pipe.conditions[1][CONDITION].evaluate.assert_called_once()
+
+
 def test_pipe_evaluate_expression():
   PIPE_CONFIG = {
     ID: 'test-pipe',
@@ -1360,6 +2410,30 @@ def test_planner_init():
   assert planner.checkpoint_unit == PIPE
 
 
+def test_planner_init_lazy_conditions():
+  PLUMBER_CONFIG = {
+    PIPES: [
+      {
+        ID: 'pipe-{}'.format(index),
+        CONDITIONS: [
+          {
+            ID: 'paths',
+            DIFF: [
+              {
+                PATH: 'service-{}/.*'.format(index)
+              }
+            ]
+          }
+        ]
+      } for index in range(2)
+    ]
+  }
+  from plumber.core import PlumberPlanner
+  planner = PlumberPlanner(PLUMBER_CONFIG)
+  assert len(planner.pipes[0].conditions) == 1
+  assert planner.pipes[1]._conditions is None
+
+
 def test_planner_init_no_global_config():
   PLUMBER_CONFIG = {
     PIPES: [
@@ -1565,7 +2639,9 @@ def test_planner_get_analysis_report():
   planner = PlumberPlanner(PLUMBER_CONFIG)
   planner.pipes[0].evaluate = MagicMock()
   planner.pipes[0].evaluate.return_value = True
+  planner.diff_service.close = MagicMock()
   report = planner.get_analysis_report()
+  planner.diff_service.close.assert_called_once()
   assert len(report) == 1
   assert report[0][ID] == 'test-pipe'
   assert report[0][DETECTED] is True
@@ -1616,11 +2692,13 @@ def test_planner_execute():
     CONDITION].create_checkpoint.return_value = 'checkpoint'
   planner.checkpoint_store.save_data = MagicMock()
   planner.checkpoint_store.save_data.return_value = None
+  planner.diff_service.close = MagicMock()
   planner.execute()
   assert planner.results is not None
   assert len(planner.results) == 1
   assert planner.results[0][STATUS] == EXECUTED
   planner.checkpoint_store.save_data.assert_called_once()
+  planner.diff_service.close.assert_called_once()
 
 
 def test_planner_execute_no_checkpoint():
@@ -1709,11 +2787,13 @@ def test_planner_execute_error():
     CONDITION].create_checkpoint.return_value = 'checkpoint'
   planner.checkpoint_store.save_data = MagicMock()
   planner.checkpoint_store.save_data.return_value = None
+  planner.diff_service.close = MagicMock()
   try:
     planner.execute()
     pytest.fail('Planner should throw exception in case of bad command')
   except Exception as e:
     assert type(e) is ExecutionFailure
+  planner.diff_service.close.assert_called_once()
   assert planner.results is not None
   assert len(planner.results) == 1
   assert planner.results[0][STATUS] == FAILED
@@ -1739,6 +2819,32 @@ def test_create_conditional():
   assert type(conditional) is LocalDiffConditional
 
 
+def test_create_conditional_worktree():
+  CONFIG = {
+    ID: 'worktree',
+    TYPE: WORKTREE,
+    DIFF: [
+      {
+        PATH: 'abc/.*'
+      }
+    ]
+  }
+  from plumber.core import _create_conditional
+  conditional = _create_conditional(CONFIG, {}, DiffService(get_repo_mock()))
+  assert type(conditional) is WorktreeConditional
+
+
+def test_create_conditional_filehash():
+  CONFIG = {
+    ID: 'artifacts',
+    TYPE: FILEHASH,
+    PATH: 'artifacts'
+  }
+  from plumber.core import _create_conditional
+  conditional = _create_conditional(CONFIG, {})
+  assert type(conditional) is FileHashConditional
+
+
 def test_create_conditional_default():
   CONFIG = {
     DIFF: [
@@ -1752,6 +2858,71 @@ def test_create_conditional_default():
   assert type(conditional) is LocalDiffConditional
 
 
+def test_create_conditional_shared():
+  conditionals = {}
+  from plumber.core import _create_conditional
+  first = _create_conditional(
+      {ID: 'first', TYPE: LOCALDIFF, DIFF: [{PATH: 'abc/.*'}]}, {}, None,
+      conditionals)
+  second = _create_conditional(
+      {ID: 'second', TYPE: 'LocalDiff', DIFF: [{PATH: 'abc/.*'}]}, {}, None,
+      conditionals)
+  from plumber.operators import SharedConditional
+  assert type(second) is SharedConditional
+  assert second.conditional is first
+  assert second.id == 'second'
+  assert len(conditionals) == 1
+
+
+def test_create_conditional_shared_distinct_checkpoint():
+  conditionals = {}
+  from plumber.core import _create_conditional
+  first = _create_conditional(
+      {ID: 'first', DIFF: [{PATH: 'abc/.*'}]}, {}, None, conditionals)
+  second = _create_conditional(
+      {ID: 'second', DIFF: [{PATH: 'abc/.*'}]}, {COMMIT: 'checkpoint'}, None,
+      conditionals)
+  third = _create_conditional(
+      {ID: 'third', DIFF: [{PATH: 'other/.*'}]}, {}, None, conditionals)
+  assert type(second) is LocalDiffConditional
+  assert type(third) is LocalDiffConditional
+  assert len(conditionals) == 3
+
+
+def test_create_conditional_not_shared_for_scans():
+  conditionals = {}
+  from plumber.core import _create_conditional
+  CONFIG = {ID: 'artifacts', TYPE: FILEHASH, PATH: 'artifacts'}
+  first = _create_conditional(CONFIG, {}, None, conditionals)
+  second = _create_conditional(CONFIG, {}, None, conditionals)
+  assert type(second) is FileHashConditional
+  assert second is not first
+  assert len(conditionals) == 0
+
+
+def test_shared_conditional_uses_own_id():
+  from plumber.operators import SharedConditional
+  shared = MagicMock()
+  shared.id = 'first'
+  ids = []
+  shared.evaluate.side_effect = lambda: ids.append(shared.id) or True
+  shared.create_checkpoint.side_effect = lambda: ids.append(shared.id) or {}
+  shared.get_cost.return_value = 1
+  conditional = SharedConditional(shared)
+  conditional.configure({ID: 'second'}, {})
+  assert conditional.evaluate() is True
+  assert conditional.create_checkpoint() == {}
+  assert conditional.get_cost() == 1
+  assert ids == ['second', 'second']
+  assert shared.id == 'first'
+
+
+def test_create_conditional_not_shared_without_registry():
+  CONFIG = {ID: 'artifacts', TYPE: FILEHASH, PATH: 'artifacts'}
+  from plumber.core import _create_conditional
+  assert _create_conditional(CONFIG, {}) is not _create_conditional(CONFIG, {})
+
+
 def test_create_conditional_invalid():
   CONFIG = {
     TYPE: LOCALGIT,
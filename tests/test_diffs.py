@@ -0,0 +1,248 @@
+import os
+import subprocess
+
+from git import Repo
+from mock import MagicMock
+
+from plumber.diffs import DiffService, parse_raw_diff, parse_log_paths
+from plumber.objects import ObjectReader
+
+
+def get_raw_diff():
+  return ''.join([
+    ':100644 100644 {} {} M\0mypath/file1\0'.format('a' * 40, 'b' * 40),
+    ':000000 100644 {} {} A\0mypath/file2\0'.format('0' * 40, 'c' * 40),
+    ':100644 000000 {} {} D\0mypath/file3\0'.format('d' * 40, '0' * 40)
+  ])
+
+
+def test_parse_raw_diff():
+  changes = parse_raw_diff(get_raw_diff())
+  assert list(changes) == ['mypath/file1', 'mypath/file2', 'mypath/file3']
+  assert changes['mypath/file1'].old_oid == 'a' * 40
+  assert changes['mypath/file1'].new_oid == 'b' * 40
+  assert changes['mypath/file2'].old_oid is None
+  assert changes['mypath/file3'].new_oid is None
+  assert changes['mypath/file3'].old_mode == '100644'
+
+
+def test_parse_raw_diff_empty():
+  assert parse_raw_diff('') == {}
+
+
+def test_diff_service_get_changes_memoized():
+  repo = MagicMock()
+  repo.git.diff_tree.return_value = get_raw_diff()
+  service = DiffService(repo)
+  changes = service.get_changes('base', 'head')
+  assert service.get_changes('base', 'head') is changes
+  repo.git.diff_tree.assert_called_once()
+  service.get_changes('base', 'head', 'testing')
+  assert repo.git.diff_tree.call_count == 2
+
+
+def test_diff_service_resolve_commit_memoized():
+  repo = MagicMock()
+  repo.git.rev_parse.return_value = 'a' * 40
+  service = DiffService(repo)
+  assert service.resolve_commit('base') == 'a' * 40
+  assert service.resolve_commit('base') == 'a' * 40
+  repo.git.rev_parse.assert_called_once()
+
+
+def test_diff_service_head_commit():
+  repo = MagicMock()
+  repo.head.commit.__str__.return_value = 'head'
+  service = DiffService(repo)
+  assert service.get_head_commit() == 'head'
+  assert service.get_head_commit() == 'head'
+  repo.head.commit.__str__.assert_called_once()
+
+
+def test_diff_service_get_path_matches():
+  repo = MagicMock()
+  repo.git.diff_tree.return_value = get_raw_diff()
+  service = DiffService(repo)
+  file1 = service.matcher.register('mypath/file1')
+  other = service.matcher.register('other/.*')
+  matched, masks = service.get_path_matches('base', 'head')
+  assert matched >> file1 & 1
+  assert not matched >> other & 1
+  assert list(masks) == ['mypath/file1']
+  assert service.get_path_matches('base', 'head') == (matched, masks)
+  repo.git.diff_tree.assert_called_once()
+
+
+def test_diff_service_get_changes_pathspecs():
+  repo = MagicMock()
+  repo.git.diff_tree.return_value = get_raw_diff()
+  service = DiffService(repo)
+  service.get_changes('base', 'head', pathspecs=['mypath', 'other'])
+  args = repo.git.diff_tree.call_args[0]
+  assert args[-3:] == ('--', ':(top,literal)mypath', ':(top,literal)other')
+
+
+def test_diff_service_get_changes_pathspecs_from_full_diff():
+  repo = MagicMock()
+  repo.git.diff_tree.return_value = get_raw_diff().replace('mypath/file3',
+                                                           'other/file3')
+  service = DiffService(repo)
+  service.get_changes('base', 'head')
+  changes = service.get_changes('base', 'head', pathspecs=['other'])
+  assert list(changes) == ['other/file3']
+  repo.git.diff_tree.assert_called_once()
+
+
+def test_diff_service_get_changes_empty_pathspecs():
+  repo = MagicMock()
+  service = DiffService(repo)
+  assert service.get_changes('base', 'head', pathspecs=[]) == {}
+  repo.git.diff_tree.assert_not_called()
+
+
+def test_diff_service_get_changed_prefixes():
+  service = DiffService(MagicMock())
+  trees = {
+    'base:mypath': ('a' * 40, 'tree', 10),
+    'base:other': ('b' * 40, 'tree', 10),
+    'head:mypath': ('a' * 40, 'tree', 10),
+    'head:other': ('c' * 40, 'tree', 10)
+  }
+  service.objects = MagicMock()
+  service.objects.get_header.side_effect = lambda name: trees.get(name)
+  assert service.get_changed_prefixes('base', 'head',
+                                      ['mypath', 'other']) == ['other']
+  assert service.get_changed_prefixes('base', 'head',
+                                      ['missing']) == []
+  assert service.get_tree_oids('head', ['missing', 'other']) == {
+    'missing': None, 'other': 'c' * 40}
+
+
+def test_object_reader(tmp_path):
+  repo_path = str(tmp_path)
+  for args in [['init', '-q'], ['config', 'user.email', 'plumber@test'],
+               ['config', 'user.name', 'plumber']]:
+    subprocess.run(['git'] + args, cwd=repo_path, check=True)
+  os.makedirs(os.path.join(repo_path, 'mypath'))
+  with open(os.path.join(repo_path, 'mypath', 'file1'), 'w') as file:
+    file.write('name: a\n')
+  subprocess.run(['git', 'add', '-A'], cwd=repo_path, check=True)
+  subprocess.run(['git', 'commit', '-q', '-m', 'commit'], cwd=repo_path,
+                 check=True)
+  reader = ObjectReader(Repo(repo_path), max_cache_size=10)
+  oid, object_type, size = reader.get_header('HEAD:mypath/file1')
+  assert object_type == 'blob'
+  assert size == 8
+  assert reader.read(oid) == ('blob', b'name: a\n')
+  assert reader.read('HEAD:mypath')[0] == 'tree'
+  assert reader.get_header('HEAD:missing file') is None
+  assert reader.read('HEAD:missing') is None
+  assert list(reader.objects) == [oid]
+  assert len(reader.processes) == 2
+  reader.close()
+  assert reader.processes == {}
+
+
+def git(cwd, *args):
+  return subprocess.run(['git'] + list(args), cwd=cwd, check=True,
+                        capture_output=True).stdout.decode().strip()
+
+
+def commit_file(repo_path, path, content):
+  file_path = os.path.join(repo_path, path)
+  os.makedirs(os.path.dirname(file_path), exist_ok=True)
+  with open(file_path, 'w') as file:
+    file.write(content)
+  git(repo_path, 'add', '-A')
+  git(repo_path, 'commit', '-q', '-m', 'change')
+  return git(repo_path, 'rev-parse', 'HEAD')
+
+
+def test_parse_log_paths():
+  output = '\x01' + 'a' * 40 + '\0\nmypath/file1\0other\0\x01' + 'b' * 40 + \
+           '\0\x01' + 'c' * 40 + '\0\nfile\0'
+  assert parse_log_paths(output) == {
+    'a' * 40: ['mypath/file1', 'other'],
+    'b' * 40: [],
+    'c' * 40: ['file']
+  }
+
+
+def test_diff_service_get_touching_commits(tmp_path):
+  repo_path = str(tmp_path)
+  git(repo_path, 'init', '-q', '-b', 'master')
+  git(repo_path, 'config', 'user.email', 'plumber@test')
+  git(repo_path, 'config', 'user.name', 'plumber')
+  base = commit_file(repo_path, 'services/billing/file1', 'a')
+  billing = commit_file(repo_path, 'services/billing/file1', 'b')
+  commit_file(repo_path, 'services/auth/file1', 'a')
+  git(repo_path, 'checkout', '-q', '-b', 'feature')
+  commit_file(repo_path, 'services/billing/file2', 'a')
+  git(repo_path, 'checkout', '-q', 'master')
+  commit_file(repo_path, 'README.md', 'a')
+  git(repo_path, 'merge', '-q', '--no-edit', 'feature')
+  merge = git(repo_path, 'rev-parse', 'HEAD')
+  feature = git(repo_path, 'rev-parse', 'feature')
+  cache_config = {'path': os.path.join(repo_path, 'cache.sqlite')}
+  service = DiffService(Repo(repo_path), cache_config)
+  assert service.get_touching_commits(base, merge, [
+    'services/billing/file1', 'services/billing/file2']) == [merge, feature,
+                                                             billing]
+  assert service.get_touching_commits(base, merge,
+                                      ['services/billing/file1']) == [billing]
+  assert service.get_touching_commits(base, merge, ['missing']) == []
+  paths = ['services/billing/{}'.format(i) for i in range(100000)]
+  assert service.get_touching_commits(base, merge, paths + [
+    'services/billing/file2']) == [merge, feature]
+  assert len(service.blooms) == 5
+  service.close()
+  repo = MagicMock(wraps=Repo(repo_path))
+  service = DiffService(repo, cache_config)
+  service.get_commit_filters(
+      git(repo_path, 'rev-list', '{}..{}'.format(base, merge)).split('\n'))
+  repo.git.log.assert_not_called()
+  assert service.get_touching_commits(base, merge,
+                                      ['services/billing/file1']) == [billing]
+  assert repo.git.log.call_count == 1
+  repo = MagicMock(wraps=Repo(repo_path))
+  service = DiffService(repo)
+  assert service.get_touching_commits(base, merge,
+                                      ['services/billing/file1']) == [billing]
+  assert repo.git.log.call_count == 1
+
+
+def test_diff_service_deepen_until(tmp_path):
+  origin_path = os.path.join(str(tmp_path), 'origin')
+  os.makedirs(origin_path)
+  git(origin_path, 'init', '-q', '-b', 'master')
+  git(origin_path, 'config', 'user.email', 'plumber@test')
+  git(origin_path, 'config', 'user.name', 'plumber')
+  checkpoint = commit_file(origin_path, 'mypath/file1', 'a')
+  for i in range(5):
+    commit_file(origin_path, 'mypath/file1', str(i))
+  clone_path = os.path.join(str(tmp_path), 'clone')
+  git(str(tmp_path), 'clone', '-q', '--depth=1',
+      'file://{}'.format(origin_path), clone_path)
+  service = DiffService(Repo(clone_path), shallow_config={'depth': 1,
+                                                          'maxdepth': 2})
+  assert service.is_shallow()
+  assert service.write_commit_graph() is False
+  assert service.resolve_commit(checkpoint) is None
+  assert service.deepen_until(checkpoint) is None
+  assert service.deepened == 2
+  service.deepen_max_depth = 64
+  assert service.deepen_until(checkpoint) == checkpoint
+  assert service.deepened == 6
+  assert service.deepen_until('f' * 40) is None
+  assert service.is_shallow() is False
+
+
+def test_diff_service_write_commit_graph(tmp_path):
+  repo_path = str(tmp_path)
+  git(repo_path, 'init', '-q', '-b', 'master')
+  git(repo_path, 'config', 'user.email', 'plumber@test')
+  git(repo_path, 'config', 'user.name', 'plumber')
+  commit_file(repo_path, 'mypath/file1', 'a')
+  assert DiffService(Repo(repo_path)).write_commit_graph()
+  assert os.path.exists(os.path.join(repo_path, '.git', 'objects', 'info',
+                                     'commit-graph'))
@@ -0,0 +1,27 @@
+from plumber.documents import parse_document, get_key_path, MISSING, INVALID
+
+
+def test_parse_document():
+  assert parse_document(b'image:\n  tag: 1.0\n', 'values.yaml') == {
+    'image': {'tag': 1.0}}
+  assert parse_document(b'{"image": {"tag": "1.0"}}', 'values.json') == {
+    'image': {'tag': '1.0'}}
+  assert parse_document(b'a: 1\n---\na: 2\n', 'docs.yaml') == [{'a': 1},
+                                                                 {'a': 2}]
+
+
+def test_parse_document_invalid():
+  assert parse_document(b'a: [1', 'values.yaml') is INVALID
+  assert parse_document(b'{', 'values.json') is INVALID
+  assert parse_document(b'\xff', 'values.yaml') is INVALID
+
+
+def test_get_key_path():
+  document = {'image': {'tag': '1.0'}, 'containers': [{'name': 'a'}],
+              'empty': None}
+  assert get_key_path(document, 'image.tag') == '1.0'
+  assert get_key_path(document, 'containers.0.name') == 'a'
+  assert get_key_path(document, 'empty') is None
+  assert get_key_path(document, 'containers.1.name') is MISSING
+  assert get_key_path(document, 'image.tag.other') is MISSING
+  assert get_key_path(MISSING, 'image') is MISSING
@@ -0,0 +1,16 @@
+from plumber.lfs import parse_lfs_pointer
+
+POINTER = b'version https://git-lfs.github.com/spec/v1\n' \
+          b'oid sha256:' + b'a' * 64 + b'\nsize 12345\n'
+
+
+def test_parse_lfs_pointer():
+  assert parse_lfs_pointer(POINTER) == ('sha256:' + 'a' * 64, 12345)
+
+
+def test_parse_lfs_pointer_not_pointer():
+  assert parse_lfs_pointer(b'name: whatever') is None
+  assert parse_lfs_pointer(b'') is None
+  assert parse_lfs_pointer(POINTER.replace(b'size 12345', b'size x')) is None
+  assert parse_lfs_pointer(POINTER + b'x' * 1024) is None
+  assert parse_lfs_pointer(POINTER + b'\xff\n') is None
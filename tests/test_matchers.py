@@ -0,0 +1,110 @@
+import pytest
+
+from plumber.common import ConfigError
+import time
+
+from plumber.matchers import PathMatcher, literal_prefix, to_pathspecs, \
+  to_pickaxe_regex, split_literal_prefix
+
+
+def test_literal_prefix():
+  assert literal_prefix('services/billing/.*') == 'services/billing/'
+  assert literal_prefix('^services/billing/.*') == 'services/billing/'
+  assert literal_prefix(r'docs/index\.md') == 'docs/index.md'
+  assert literal_prefix('services/bills?/.*') == 'services/bill'
+  assert literal_prefix('services/(a|b)/.*') == 'services/'
+  assert literal_prefix('a/.*|b/.*') == ''
+  assert literal_prefix(r'\d+/file') == ''
+  assert literal_prefix('.*') == ''
+
+
+def test_split_literal_prefix():
+  assert split_literal_prefix('services/billing/.*') == ('services/billing/',
+                                                         '.*')
+  assert split_literal_prefix(r'docs/index\.md') == ('docs/index.md', '')
+  assert split_literal_prefix('services/bills?/.*') == ('services/bill',
+                                                        's?/.*')
+  assert split_literal_prefix('a/.*|b/.*') == ('', 'a/.*|b/.*')
+
+
+def test_path_matcher_register():
+  matcher = PathMatcher()
+  assert matcher.register('a/.*') == 0
+  assert matcher.register('b/.*') == 1
+  assert matcher.register('a/.*') == 0
+
+
+def test_path_matcher_register_invalid():
+  matcher = PathMatcher()
+  try:
+    matcher.register('a/(.*')
+    pytest.fail('Invalid pattern should not be registered')
+  except Exception as e:
+    assert type(e) is ConfigError
+
+
+def test_path_matcher_match():
+  matcher = PathMatcher()
+  patterns = ['services/billing/.*', 'services/.*', '.*\\.md', 'docs/(a)\\1',
+              '(?i)README.*', 'services/billing/x']
+  ids = [matcher.register(pattern) for pattern in patterns]
+  matcher.compile()
+  assert matcher.match('services/billing/x') == \
+         1 << ids[0] | 1 << ids[1] | 1 << ids[5]
+  assert matcher.match('services/auth/README.md') == 1 << ids[1] | 1 << ids[2]
+  assert matcher.match('docs/aa') == 1 << ids[3]
+  assert matcher.match('readme.txt') == 1 << ids[4]
+  assert matcher.match('other/file') == 0
+
+
+def test_path_matcher_match_paths():
+  matcher = PathMatcher()
+  billing = matcher.register('services/billing/.*')
+  docs = matcher.register('docs/.*')
+  matched, masks = matcher.match_paths(
+      ['services/billing/a', 'services/auth/a', 'lib/a'])
+  assert matched == 1 << billing
+  assert masks == {'services/billing/a': 1 << billing}
+  assert not matched >> docs & 1
+
+
+def test_path_matcher_match_shared_directory():
+  matcher = PathMatcher()
+  prefixes = [matcher.register('services/s{}/.*'.format(i)) for i in
+              range(2000)]
+  sources = [matcher.register('services/s{}/.*\\.py'.format(i)) for i in
+             range(2000)]
+  shared = matcher.register('services/.*/README.md')
+  paths = ['services/s{}/src/file{}.{}'.format(i % 2000, i,
+                                               'py' if i % 2 else 'txt') for i
+           in range(20000)] + ['services/s7/README.md', 'lib/file.py']
+  start = time.time()
+  matched, masks = matcher.match_paths(paths)
+  assert time.time() - start < 5
+  assert len(masks) == 20001
+  assert masks['services/s1/src/file1.py'] == 1 << prefixes[1] | 1 << sources[
+    1]
+  assert masks['services/s2/src/file2.txt'] == 1 << prefixes[2]
+  assert masks['services/s7/README.md'] == 1 << prefixes[7] | 1 << shared
+  assert 'lib/file.py' not in masks
+
+
+def test_to_pathspecs():
+  assert to_pathspecs(['services/billing/.*', 'services/auth/.*\\.py']) == [
+    'services/auth', 'services/billing']
+  assert to_pathspecs(['services/.*', 'services/billing/.*']) == ['services']
+  assert to_pathspecs(['services/bill.*']) == ['services']
+  assert to_pathspecs(['services/billing/.*', '.*\\.md']) is None
+  assert to_pathspecs(['README.md']) is None
+  assert to_pathspecs([]) == []
+
+
+def test_to_pickaxe_regex():
+  assert to_pickaxe_regex('image:.*') == '^image:.*'
+  assert to_pickaxe_regex('^image: [a-z]+') == '^image: [a-z]+'
+  assert to_pickaxe_regex('a|b') == '^(a|b)'
+  assert to_pickaxe_regex(r'image\.tag') == r'^image\.tag'
+  assert to_pickaxe_regex(r'\d+') is None
+  assert to_pickaxe_regex('(?:a)') is None
+  assert to_pickaxe_regex('a.*?b') is None
+  assert to_pickaxe_regex(r'[\d]') is None